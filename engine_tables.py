@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from piece import (BLACK, WHITE, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, BOARD_LENGTH, BOARD_WIDTH,
+                   DIAGONAL_DIRECTIONS, STRAIGHT_DIRECTIONS)
+
+# Bump whenever the layout or meaning of the tables changes
+TABLES_VERSION = 1
+MAGIC = b"MCTB"
+# Tables are regenerated when any of these files change
+SOURCE_FILES = ["piece.py", "engine_tables.py"]
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine_tables.bin")
+# Arrays are stored at offsets that are multiples of this
+ALIGNMENT = 64
+
+NUM_SQUARES = BOARD_LENGTH * BOARD_WIDTH
+# Extra always empty square that pads short paths
+EMPTY_SQUARE = NUM_SQUARES
+MAX_PATH = max(BOARD_LENGTH, BOARD_WIDTH) - 2
+
+# Kinds of move templates
+NORMAL = 0
+# Pawn moves forward only onto empty squares
+QUIET_ONLY = 1
+# and diagonally only when capturing
+CAPTURE_ONLY = 2
+
+KNIGHT_DIRECTIONS = [[-1, 2], [2, -1], [-1, -2], [-2, -1], [2, 1], [1, 2], [-2, 1], [1, -2]]
+
+def piece_code(color, piece_type) -> int:
+    '''
+    Returns the code of a piece in our board arrays, 0 is an empty square
+    '''
+    return 1 + color * 6 + piece_type
+
+def move_templates() -> 'Tuple':
+    '''
+    Returns every move any piece could make from any square, as arrays over templates:
+    from square, to square, piece code, path squares that must be empty (padded with
+    EMPTY_SQUARE) and kind (NORMAL, QUIET_ONLY or CAPTURE_ONLY)
+    These mirror the move functions in piece.py, including the pawn's capture being
+    listed twice so that random moves are sampled exactly like random.choice(player_legal_moves())
+    '''
+    templates = []
+    def on_board(x, y):
+        return 0 <= x < BOARD_LENGTH and 0 <= y < BOARD_WIDTH
+
+    for color in (BLACK, WHITE):
+        for x in range(BOARD_LENGTH):
+            for y in range(BOARD_WIDTH):
+                def add(piece_type, nx, ny, path, kind = NORMAL):
+                    templates.append((x * BOARD_WIDTH + y, nx * BOARD_WIDTH + ny, piece_code(color, piece_type),
+                                      path + [EMPTY_SQUARE] * (MAX_PATH - len(path)), kind))
+
+                for piece_type, directions in ((QUEEN, STRAIGHT_DIRECTIONS + DIAGONAL_DIRECTIONS),
+                                               (ROOK, STRAIGHT_DIRECTIONS), (BISHOP, DIAGONAL_DIRECTIONS)):
+                    for dx, dy in directions:
+                        nx, ny, path = x + dx, y + dy, []
+                        while on_board(nx, ny):
+                            add(piece_type, nx, ny, list(path))
+                            path.append(nx * BOARD_WIDTH + ny)
+                            nx, ny = nx + dx, ny + dy
+                for piece_type, directions in ((KING, STRAIGHT_DIRECTIONS + DIAGONAL_DIRECTIONS), (KNIGHT, KNIGHT_DIRECTIONS)):
+                    for dx, dy in directions:
+                        if on_board(x + dx, y + dy):
+                            add(piece_type, x + dx, y + dy, [])
+                forward = 1 if color == BLACK else -1
+                if on_board(x + forward, y):
+                    add(PAWN, x + forward, y, [], QUIET_ONLY)
+                capture_dx = -1 if color == BLACK else 1
+                for _ in range(2):
+                    if on_board(x + capture_dx, y - 1):
+                        add(PAWN, x + capture_dx, y - 1, [], CAPTURE_ONLY)
+
+    from_squares, to_squares, codes, paths, kinds = zip(*templates)
+    return (np.array(from_squares), np.array(to_squares), np.array(codes, dtype = np.int8),
+            np.array(paths), np.array(kinds, dtype = np.int8))
+
+def build_tables() -> dict:
+    '''
+    Generates every static table used by RandomPlayoutEngine, as a dict from name to array:
+        from_squares_{color}, to_squares_{color}, codes_{color}, paths_{color}, kinds_{color}
+            --- the move templates of each color (see move_templates)
+        attack_from, attack_codes, attack_paths --- indexed by [color, square], the templates of
+            the other color that capture on square, padded to the same length with a code that never matches
+    '''
+    from_squares, to_squares, codes, paths, kinds = move_templates()
+    colors = (codes - 1) // 6
+    tables = {}
+    for color in (BLACK, WHITE):
+        keep = colors == color
+        tables[f"from_squares_{color}"] = from_squares[keep].astype(np.intp)
+        tables[f"to_squares_{color}"] = to_squares[keep].astype(np.intp)
+        tables[f"codes_{color}"] = codes[keep]
+        tables[f"paths_{color}"] = paths[keep].astype(np.intp)
+        tables[f"kinds_{color}"] = kinds[keep]
+
+    attackers = [[np.flatnonzero((colors != color) & (kinds != QUIET_ONLY) & (to_squares == square))
+                  for square in range(NUM_SQUARES)] for color in (BLACK, WHITE)]
+    width = max(len(a) for by_square in attackers for a in by_square)
+    attack_from = np.zeros((2, NUM_SQUARES, width), dtype = np.intp)
+    attack_codes = np.full((2, NUM_SQUARES, width), -1, dtype = np.int8)
+    attack_paths = np.full((2, NUM_SQUARES, width, MAX_PATH), EMPTY_SQUARE, dtype = np.intp)
+    for color in (BLACK, WHITE):
+        for square in range(NUM_SQUARES):
+            a = attackers[color][square]
+            attack_from[color, square, :len(a)] = from_squares[a]
+            attack_codes[color, square, :len(a)] = codes[a]
+            attack_paths[color, square, :len(a)] = paths[a]
+    tables["attack_from"] = attack_from
+    tables["attack_codes"] = attack_codes
+    tables["attack_paths"] = attack_paths
+    return tables
+
+def source_fingerprint() -> bytes:
+    '''
+    Returns a hash of TABLES_VERSION, the platform's integer size and the files the tables are generated from
+    '''
+    digest = hashlib.sha1(f"{TABLES_VERSION} {np.dtype(np.intp).str}".encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCE_FILES:
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
+
+def save_tables(tables, path) -> None:
+    '''
+    Writes tables to path: MAGIC, TABLES_VERSION, the source fingerprint, a JSON index of
+    [name, dtype, shape, offset] and then the raw arrays, each aligned to ALIGNMENT bytes
+    The file is written under a temporary name and renamed so that readers never see it half written
+    '''
+    index, offset = [], 0
+    for name, array in tables.items():
+        index.append([name, array.dtype.str, list(array.shape), offset])
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    index = json.dumps(index).encode()
+    header = MAGIC + TABLES_VERSION.to_bytes(4, "little") + source_fingerprint() + len(index).to_bytes(4, "little") + index
+    data_start = -(-len(header) // ALIGNMENT) * ALIGNMENT
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header.ljust(data_start, b"\0"))
+        for (name, dtype, shape, offset), array in zip(json.loads(index), tables.values()):
+            f.seek(data_start + offset)
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temp_path, path)
+
+def read_tables(path) -> dict:
+    '''
+    Returns the tables stored in path as read-only arrays memory-mapped from the file,
+    or None if the file is missing, damaged or was written for another version or source
+    '''
+    try:
+        data = np.memmap(path, dtype = np.uint8, mode = "r")
+    except (OSError, ValueError):
+        return None
+    fingerprint = source_fingerprint()
+    prefix = len(MAGIC) + 4 + len(fingerprint)
+    if (len(data) < prefix + 4 or bytes(data[:len(MAGIC)]) != MAGIC
+            or int.from_bytes(bytes(data[len(MAGIC):len(MAGIC) + 4]), "little") != TABLES_VERSION
+            or bytes(data[len(MAGIC) + 4:prefix]) != fingerprint):
+        return None
+    index_length = int.from_bytes(bytes(data[prefix:prefix + 4]), "little")
+    try:
+        index = json.loads(bytes(data[prefix + 4:prefix + 4 + index_length]))
+    except ValueError:
+        return None
+    data_start = -(-(prefix + 4 + index_length) // ALIGNMENT) * ALIGNMENT
+
+    tables = {}
+    for name, dtype, shape, offset in index:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        if data_start + offset + dtype.itemsize * count > len(data):
+            return None
+        # Plain arrays over the mapping, np.memmap views would slow down every operation on them
+        tables[name] = np.frombuffer(data, dtype, count, data_start + offset).reshape(shape)
+    return tables
+
+def load_tables(path = DEFAULT_PATH) -> dict:
+    '''
+    Returns the static engine tables (see build_tables), memory-mapped from the cache file at path
+    If the file is missing or stale, the tables are regenerated and the file rewritten
+    When path can't be written to, the regenerated tables are just used from memory
+
+    path --- Cache file, None to always regenerate
+    '''
+    if path is not None:
+        tables = read_tables(path)
+        if tables is not None:
+            return tables
+    tables = build_tables()
+    if path is not None:
+        try:
+            save_tables(tables, path)
+        except OSError:
+            return tables
+        tables = read_tables(path) or tables
+    return tables
+
+# Each is run in a fresh interpreter, like a newly started worker process
+STARTUP_SCRIPT = '''
+from time import perf_counter
+start = perf_counter()
+import random_playout
+imported = perf_counter()
+random_playout.load_tables({path!r})
+loaded = perf_counter()
+random_playout.RandomPlayoutEngine(tables_path = {path!r})
+print(imported - start, loaded - imported, perf_counter() - loaded)
+'''
+
+def startup_time(path, runs = 5) -> 'Tuple':
+    '''
+    Returns the best (import_time, tables_time, engine_time) in seconds over runs fresh interpreters
+    that import random_playout, load the tables at path and then create a RandomPlayoutEngine
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    best = [float("inf")] * 3
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(path = path)], cwd = directory,
+                                capture_output = True, text = True, check = True).stdout
+        times = [float(t) for t in output.split()]
+        best = [min(b, t) for b, t in zip(best, times)]
+    return tuple(best)
+
+def main():
+    '''
+    Reports how long a new process takes to import the engine, load its tables and create a
+    RandomPlayoutEngine, with the tables memory-mapped from the cache file and with them regenerated
+    The first RandomPlayoutEngine also pays for NumPy lazily importing numpy.random
+
+    Users should run: python3 engine_tables.py [cache_file] [runs]
+    '''
+    argv = sys.argv
+    path = argv[1] if len(argv) > 1 else DEFAULT_PATH
+    runs = int(argv[2]) if len(argv) > 2 else 5
+
+    start = perf_counter()
+    build_tables()
+    print(f"Generating the tables took {round((perf_counter() - start) * 1000, 2)}ms")
+    if read_tables(path) is None:
+        print(f"{path} is missing or stale, regenerating it")
+        save_tables(build_tables(), path)
+    start = perf_counter()
+    read_tables(path)
+    print(f"Mapping the tables from {path} took {round((perf_counter() - start) * 1000, 2)}ms")
+
+    for label, tables_path in (("cached tables", path), ("regenerated tables", None)):
+        import_time, tables_time, engine_time = startup_time(tables_path, runs)
+        print(f"With {label}: import {round(import_time * 1000, 1)}ms, tables {round(tables_time * 1000, 2)}ms, "
+              f"RandomPlayoutEngine() {round(engine_time * 1000, 1)}ms")
+
+if __name__ == "__main__":
+    main()
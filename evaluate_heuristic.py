@@ -1,9 +1,10 @@
+from functools import partial
 import random
 import time
 
 from piece import KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, BLACK, WHITE
 from microchess import MicroChess, DRAW
-from mini_max_agent import MiniMaxAgent
+from mini_max_agent import MiniMaxAgent, BatchMiniMaxAgent
 
 def value_based_heuristic(pos, weights: 'List[int]'):
     '''
@@ -22,6 +23,24 @@ def value_based_heuristic(pos, weights: 'List[int]'):
         white_pieces_value += weights[piece.get_piece_type()]
     return black_pieces_value - white_pieces_value
 
+def cached_value_based_heuristic(pos, weights: 'List[int]', cache):
+    '''
+    Same as value_based_heuristic, with the same result down to the last bit, but reads
+    the piece types from a PositionCache instead of walking the pieces
+
+    pos --- Position in game
+    weights --- List[int] representing the value of each piece
+    cache --- PositionCache shared between heuristics
+    '''
+    black_types, white_types = cache.material(pos)
+    weights = [0, 0] + weights
+    black_pieces_value, white_pieces_value = 0, 0
+    for piece_type in black_types:
+        black_pieces_value += weights[piece_type]
+    for piece_type in white_types:
+        white_pieces_value += weights[piece_type]
+    return black_pieces_value - white_pieces_value
+
 def simple_heuristic(pos):
     '''
     Heuristic where different pieces have different values
@@ -35,13 +54,62 @@ def uniform_heuristic(pos):
     '''
     return len(pos.get_black_pieces()) - len(pos.get_white_pieces())
 
+# Upper bounds, indexed by piece type, on how much capturing a piece changes each heuristic
+# Kings are never captured, and pieces are never promoted so there are no queens to capture
+CAPTURE_VALUES = {
+    simple_heuristic: [float("inf"), 0, 6, 3, 3, 1],
+    uniform_heuristic: [float("inf"), 1, 1, 1, 1, 1]
+}
+
+def capture_values(heuristic_fxn) -> 'List':
+    '''
+    Returns the capture_values MiniMaxAgent should delta prune with for heuristic_fxn, or None
+    (no delta pruning) for heuristics without a known bound
+    value_based_heuristic, eg. via functools.partial, is bounded by the size of its weights
+
+    heuristic_fxn --- function that given Position returns a value
+    '''
+    if heuristic_fxn in CAPTURE_VALUES:
+        return CAPTURE_VALUES[heuristic_fxn]
+    if isinstance(heuristic_fxn, partial) and heuristic_fxn.func == value_based_heuristic \
+            and "weights" in heuristic_fxn.keywords:
+        return [float("inf"), 0] + [abs(w) for w in heuristic_fxn.keywords["weights"]]
+    return None
+
 def random_heuristic(pos):
     '''
     Play randomly, used more as a placeholder than anything
     '''
     return random.random()
 
-def compare_heuristic(heuristic_fxn_1, heuristic_fxn_2, num_games, prob, depth) -> float:
+def play_game(black_fxn, white_fxn, prob, depth, quiescence = False, rng = random) -> int:
+    '''
+    Plays one game between two heuristic functions and returns the winner: BLACK, WHITE or DRAW
+    Like compare_heuristic, random_heuristic plays completely randomly
+
+    black_fxn --- function that given Position returns a value, plays BLACK
+    white_fxn --- function that given Position returns a value, plays WHITE
+    prob --- Probability that the agents will not play randomly
+    depth --- Depth of minimax search
+    quiescence --- Whether the minimax agents extend their leaves with a capture search
+    rng --- random.Random the random moves are drawn from, defaults to the random module
+    '''
+    agents = {}
+    for color, fxn in ((BLACK, black_fxn), (WHITE, white_fxn)):
+        agents[color] = None if fxn == random_heuristic else \
+            MiniMaxAgent(fxn, depth, quiescence, capture_values = capture_values(fxn))
+
+    pos = MicroChess().initial_pos()
+    while pos.winner() == -1:
+        agent = agents[pos.get_turn()]
+        if agent is not None and rng.random() < prob:
+            move = agent.choose_next_move(pos)
+        else:
+            move = rng.choice(pos.player_legal_moves())
+        pos = pos.result(move)
+    return pos.winner()
+
+def compare_heuristic(heuristic_fxn_1, heuristic_fxn_2, num_games, prob, depth, quiescence = False, cache = None) -> float:
     '''
     Compares two heuristic functions against each other by creating 2 minimax agents
     Then battle them against each other in num_games 
@@ -53,17 +121,21 @@ def compare_heuristic(heuristic_fxn_1, heuristic_fxn_2, num_games, prob, depth)
         their fitness, int
     prob --- Probability that the agents will not play randomly
     depth --- Depth of minimax search
+    quiescence --- Whether the minimax agents extend their leaves with a capture search
+    cache --- Optional PositionCache for legal moves and game results
     '''
     start = time.time()
-    p1 = MiniMaxAgent(heuristic_fxn_1, depth)
+    p1 = MiniMaxAgent(heuristic_fxn_1, depth, quiescence, capture_values = capture_values(heuristic_fxn_1), cache = cache)
     if heuristic_fxn_2 != random_heuristic:
-        p2 = MiniMaxAgent(heuristic_fxn_2, depth)
+        p2 = MiniMaxAgent(heuristic_fxn_2, depth, quiescence, capture_values = capture_values(heuristic_fxn_2), cache = cache)
+    # p1 goes through the cache (if any) for the random moves too
+    winner, legal_moves = p1.winner, p1.legal_moves
     p1_wins, p2_wins, draws = 0, 0, 0
 
     mc = MicroChess()
     for i in range(num_games):
         pos = mc.initial_pos()
-        while pos.winner() == -1:
+        while winner(pos) == -1:
             # Play with our strategy
             if random.random() < prob:
                 # We have p1 and p2 alternate being BLACK/WHITE
@@ -74,14 +146,15 @@ def compare_heuristic(heuristic_fxn_1, heuristic_fxn_2, num_games, prob, depth)
                     if heuristic_fxn_2 != random_heuristic:
                         move = p2.choose_next_move(pos)
                     else:
-                        move = random.choice(pos.player_legal_moves())
+                        move = random.choice(legal_moves(pos))
             # Play randomly
             else:
-                move = random.choice(pos.player_legal_moves())
+                move = random.choice(legal_moves(pos))
             pos = pos.result(move)
-        if pos.winner() == DRAW:
+        result = winner(pos)
+        if result == DRAW:
             draws += 1
-        elif (pos.winner() == BLACK and i % 2 == BLACK) or (pos.winner() == WHITE and i % 2 == WHITE):
+        elif (result == BLACK and i % 2 == BLACK) or (result == WHITE and i % 2 == WHITE):
             p1_wins += 1
         else:
             p2_wins += 1
@@ -89,3 +162,65 @@ def compare_heuristic(heuristic_fxn_1, heuristic_fxn_2, num_games, prob, depth)
     #print(f"Simulation took {round(time.time() - start, 2)}s")
     #print(f"p1_wins: {p1_wins}, p2_wins: {p2_wins}, draws: {draws}")
     return (p1_wins + draws / 2) / num_games
+
+def compare_population(weights_list, heuristic_fxn_2, num_games, prob, depth, cache = None) -> 'List[float]':
+    '''
+    Same as calling compare_heuristic with value_based_heuristic for every weights in weights_list,
+    but all K candidates play each game together with common random numbers. Candidates stay
+    in one shared game until their chosen moves differ, and one BatchMiniMaxAgent tree walk
+    decides the move for every candidate in a shared game
+    Return the win percentage of each weights
+
+    weights_list --- List of weights as taken by value_based_heuristic
+    heuristic_fxn_2 --- function that given Position returns a value
+    num_games --- the number of games each individual should play, int
+    prob --- Probability that the agents will not play randomly
+    depth --- Depth of minimax search
+    cache --- Optional PositionCache for legal moves, game results and material
+    '''
+    p1 = BatchMiniMaxAgent(weights_list, depth, cache)
+    p2 = MiniMaxAgent(heuristic_fxn_2, depth, cache = cache)
+    winner, legal_moves = p2.winner, p2.legal_moves
+    scores = [0] * len(weights_list)
+
+    mc = MicroChess()
+    for i in range(num_games):
+        # Each shared game is [pos, rng, candidates playing it]
+        games = [[mc.initial_pos(), random.Random(random.random()), list(range(len(weights_list)))]]
+        while len(games) > 0:
+            next_games = []
+            for pos, rng, ks in games:
+                # Play with our strategy
+                if rng.random() < prob:
+                    # When i is even, the candidates act as BLACK
+                    if pos.get_turn() == i % 2:
+                        by_move = {}
+                        for k, move in zip(ks, p1.choose_next_moves(pos, ks)):
+                            by_move.setdefault(tuple(map(tuple, move)), [move, []])[1].append(k)
+                        splits = list(by_move.values())
+                    elif heuristic_fxn_2 != random_heuristic:
+                        splits = [[p2.choose_next_move(pos), ks]]
+                    else:
+                        splits = [[rng.choice(legal_moves(pos)), ks]]
+                # Play randomly
+                else:
+                    splits = [[rng.choice(legal_moves(pos)), ks]]
+
+                for j, (move, split_ks) in enumerate(splits):
+                    # The last split can reuse pos and rng, the others get their own copies
+                    if j == len(splits) - 1:
+                        split_pos, split_rng = pos.result(move), rng
+                    else:
+                        split_pos, split_rng = pos.result_copy(move), random.Random()
+                        split_rng.setstate(rng.getstate())
+                    result = winner(split_pos)
+                    if result == -1:
+                        next_games.append([split_pos, split_rng, split_ks])
+                        continue
+                    for k in split_ks:
+                        if result == DRAW:
+                            scores[k] += 0.5
+                        elif result == i % 2:
+                            scores[k] += 1
+            games = next_games
+    return [score / num_games for score in scores]
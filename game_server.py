@@ -0,0 +1,308 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import itertools
+import json
+import sys
+from time import time
+
+from microchess import MicroChess
+from mini_max_agent import MiniMaxAgent
+import evaluate_heuristic as eh
+
+HEURISTICS = {
+    "simple": eh.simple_heuristic,
+    "uniform": eh.uniform_heuristic,
+    "random": eh.random_heuristic
+}
+
+def heuristic_from_request(heuristic):
+    '''
+    Returns the heuristic function for a request's "heuristic" field: either the name of one
+    of HEURISTICS or a list of weights for value_based_heuristic
+    '''
+    if isinstance(heuristic, list):
+        if len(heuristic) != 4 or not all(isinstance(w, (int, float)) and not isinstance(w, bool) for w in heuristic):
+            raise ValueError("heuristic weights must be a list of 4 numbers")
+        return partial(eh.value_based_heuristic, weights = heuristic)
+    if heuristic not in HEURISTICS:
+        raise ValueError(f"unknown heuristic {heuristic}")
+    return HEURISTICS[heuristic]
+
+def _search(encoding, heuristic, depth, quiescence, deadline):
+    '''
+    Worker that searches an encoded position to depth and returns [value, move],
+    or None if the search was still running at deadline (a time.time())
+    Giving up at the deadline frees the worker for other sessions' searches
+    '''
+    heuristic_fxn = heuristic_from_request(heuristic)
+    agent = MiniMaxAgent(heuristic_fxn, depth, quiescence, capture_values = eh.capture_values(heuristic_fxn),
+                         deadline = deadline)
+    try:
+        return agent.minimax(MicroChess.Position.decode(encoding), depth, heuristic_fxn)
+    except TimeoutError:
+        return None
+
+def _json_value(value):
+    # JSON has no infinity, forced wins and losses are reported as strings
+    if value in (float("inf"), float("-inf")):
+        return str(value)
+    return value
+
+class GameServer:
+    '''
+    Local asyncio service hosting many concurrent MicroChess games
+
+    Clients send one JSON request per line and get JSON messages back with the request's "id".
+    Requests on a connection are handled concurrently, so a slow search never holds up
+    other requests or sessions. Searches run in a process pool.
+
+    Requests ("cmd" and its fields):
+        new_game --- starts a game, replies with its "game" id
+        state (game) --- replies with the game's position, turn and winner
+        legal_moves (game) --- replies with the legal moves of the player to move
+        move (game, move) --- plays move if it is legal, replies with the new state
+        search (game, heuristic, max_depth, deadline, quiescence) --- iterative deepening search.
+            Streams an "info" message with the best move so far after every finished depth,
+            then a "bestmove" message when max_depth is done or deadline seconds have passed
+        close_game (game) --- forgets the game
+    '''
+
+    def __init__(self, workers = None):
+        '''
+        workers --- Number of worker processes for searches, defaults to the number of CPUs
+        '''
+        self.mc = MicroChess()
+        # Session state is the compact Position.encode() of each game
+        self.games = {}
+        self._game_ids = itertools.count(1)
+        self._executor = ProcessPoolExecutor(workers)
+        self._server = None
+        self._writers = set()
+        self._handlers = set()
+
+    async def start(self, host = "127.0.0.1", port = 0, path = None):
+        '''
+        Starts listening on host:port, or on the Unix socket at path if given
+        Returns the address clients should connect to
+        '''
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path)
+            return path
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        # Closing open connections lets their handlers see EOF instead of being cancelled
+        for writer in list(self._writers):
+            writer.close()
+        if self._handlers:
+            await asyncio.wait(self._handlers, timeout = 1)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(cancel_futures = True)
+
+    async def _handle_connection(self, reader, writer):
+        tasks = set()
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self._handle_request(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _handle_request(self, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("requests must be JSON objects")
+            request_id = request.get("id")
+
+            async def send(message):
+                message["id"] = request_id
+                writer.write(json.dumps(message).encode() + b"\n")
+                await writer.drain()
+
+            cmd = request.get("cmd")
+            if cmd == "search":
+                await self._search(request, send)
+            elif cmd in ("new_game", "state", "legal_moves", "move", "close_game"):
+                await send(dict(type = "result", **getattr(self, "_" + cmd)(request)))
+            else:
+                raise ValueError(f"unknown cmd {cmd}")
+        except (ValueError, KeyError, TypeError) as e:
+            writer.write(json.dumps({"id": request_id, "type": "error", "error": str(e)}).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        except Exception as e:
+            # Anything else, eg. a worker dying, still gets a reply so the client isn't left waiting
+            try:
+                writer.write(json.dumps({"id": request_id, "type": "error", "error": repr(e)}).encode() + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    def _position(self, request):
+        if request["game"] not in self.games:
+            raise ValueError(f"unknown game {request['game']}")
+        return MicroChess.Position.decode(self.games[request["game"]])
+
+    def _state(self, request):
+        pos = self._position(request)
+        return {"game": request["game"], "position": self.games[request["game"]].hex(),
+                "turn": pos.get_turn(), "winner": pos.winner()}
+
+    def _new_game(self, request):
+        game = next(self._game_ids)
+        self.games[game] = self.mc.initial_pos().encode()
+        return self._state({"game": game})
+
+    def _legal_moves(self, request):
+        return {"game": request["game"], "moves": self._position(request).player_legal_moves()}
+
+    def _move(self, request):
+        pos = self._position(request)
+        if pos.winner() != -1:
+            raise ValueError("the game is over")
+        move = request["move"]
+        if move not in pos.player_legal_moves():
+            raise ValueError(f"illegal move {move}")
+        self.games[request["game"]] = pos.result(move).encode()
+        return self._state(request)
+
+    def _close_game(self, request):
+        self._position(request)
+        del self.games[request["game"]]
+        return {"game": request["game"]}
+
+    async def _search(self, request, send):
+        pos = self._position(request)
+        encoding = self.games[request["game"]]
+        heuristic = request.get("heuristic", "simple")
+        heuristic_from_request(heuristic)
+        max_depth = int(request.get("max_depth", 4))
+        quiescence = bool(request.get("quiescence", False))
+        deadline = time() + float(request.get("deadline", 10))
+
+        loop = asyncio.get_running_loop()
+        moves = pos.player_legal_moves()
+        # Something to answer with even if depth 1 doesn't finish in time
+        best = {"move": moves[0] if moves else None, "value": None, "depth": 0}
+        for depth in range(1, max_depth + 1):
+            remaining = deadline - time()
+            if remaining <= 0 or not moves:
+                break
+            future = loop.run_in_executor(self._executor, _search, encoding, heuristic, depth, quiescence, deadline)
+            try:
+                result = await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                # The worker gives up on its own at the deadline
+                break
+            if result is None:
+                break
+            value, move = result
+            best = {"move": move, "value": _json_value(value), "depth": depth}
+            await send(dict(type = "info", **best))
+            # A forced result won't change with more depth
+            if value in (float("inf"), float("-inf")):
+                break
+        await send(dict(type = "bestmove", **best))
+
+class GameClient:
+    '''
+    Client for GameServer, used for local play and testing
+    '''
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._queues = {}
+        self._reader_task = None
+
+    async def connect(self, address):
+        '''
+        address --- (host, port) or the path of a Unix socket, as returned by GameServer.start
+        '''
+        if isinstance(address, str):
+            self._reader, self._writer = await asyncio.open_unix_connection(address)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(*address)
+        self._reader_task = asyncio.create_task(self._read_messages())
+
+    async def _read_messages(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            self._queues[message["id"]].put_nowait(message)
+
+    async def stream(self, cmd, **fields):
+        '''
+        Sends a request and yields every message sent back for it, until the final one
+        '''
+        request_id = next(self._ids)
+        self._queues[request_id] = asyncio.Queue()
+        self._writer.write(json.dumps(dict(id = request_id, cmd = cmd, **fields)).encode() + b"\n")
+        await self._writer.drain()
+        try:
+            while True:
+                message = await self._queues[request_id].get()
+                yield message
+                if message["type"] != "info":
+                    return
+        finally:
+            del self._queues[request_id]
+
+    async def request(self, cmd, **fields):
+        '''
+        Sends a request and returns its final message
+        Raises ValueError if the server replied with an error
+        '''
+        async for message in self.stream(cmd, **fields):
+            pass
+        if message["type"] == "error":
+            raise ValueError(message["error"])
+        return message
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._reader_task.cancel()
+
+async def serve(address, workers):
+    server = GameServer(workers)
+    if address.isdigit():
+        print(f"Serving on {await server.start(port = int(address))}")
+    else:
+        print(f"Serving on {await server.start(path = address)}")
+    await server.serve_forever()
+
+def main():
+    '''
+    Handles command line input
+
+    Users should run: python3 game_server.py [port | unix_socket_path] [workers]
+    '''
+    argv = sys.argv
+    address = argv[1] if len(argv) > 1 else "8765"
+    workers = int(argv[2]) if len(argv) > 2 else None
+    asyncio.run(serve(address, workers))
+
+if __name__ == "__main__":
+    main()
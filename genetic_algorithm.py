@@ -5,6 +5,13 @@ from time import time
 
 from piece import QUEEN, ROOK, KNIGHT, BISHOP, PAWN
 import evaluate_heuristic as eh
+import tournament
+from position_cache import PositionCache
+try:
+    # Needs NumPy, which may not be available under PyPy
+    import random_playout
+except ImportError:
+    random_playout = None
 
 pieces_list = [ROOK, KNIGHT, BISHOP, PAWN]
 
@@ -28,7 +35,8 @@ def random_population(pop_size) -> 'List':
         pop.append(piece_values)
     return pop
     
-def select_most_fit(pop, fitness_dict, target_size, num_games, prob, depth) -> 'List':
+def select_most_fit(pop, fitness_dict, target_size, num_games, prob, depth, cache = None, shared_tree = False,
+                    use_tournament = False, processes = 1) -> 'List':
     '''
     Given a population, it aims to return a subset of the poplation of size target_size
     that is the most fit
@@ -37,22 +45,38 @@ def select_most_fit(pop, fitness_dict, target_size, num_games, prob, depth) -> '
     pop --- Population, List
     fitness_dict --- Memo linking weight to its calculated fitness, dict
     target_size --- Desired size of population, int
+    cache --- Optional PositionCache shared by every individual, PositionCache
+    shared_tree --- If True, the whole population plays in lockstep and shares search trees, bool
+    use_tournament --- If True, the population is ranked by one Swiss tournament of num_games rounds
+        instead of each individual playing num_games against uniform_heuristic, bool
+    processes --- Number of worker processes playing tournament games, int
     '''
     pop_size = len(pop)
     if target_size > pop_size:
         raise ValueError("select_most_fit --- can't return a subset that is greater in size")
-    for weights in pop:
-        # It's in our memo
-        # if tuple(weights) in fitness_dict:
-        #    continue
-
-        def fxn(pos):
-            return eh.value_based_heuristic(pos, weights)
-
-        #vs_random = eh.compare_heuristic(fxn, eh.random_heuristic, num_games, prob, depth)
-        vs_uniform = eh.compare_heuristic(fxn, eh.uniform_heuristic, num_games, prob, depth)
-        # print(f"vs_random: {vs_random}, vs_uniform: {vs_uniform}, vs_simple: {vs_simple}")
-        fitness_dict[tuple(weights)] = vs_uniform
+    if use_tournament:
+        vs_uniform = tournament.rank_population(pop, num_games, prob, depth, processes)
+        for weights, fitness in zip(pop, vs_uniform):
+            fitness_dict[tuple(weights)] = fitness
+    elif shared_tree:
+        vs_uniform = eh.compare_population(pop, eh.uniform_heuristic, num_games, prob, depth, cache)
+        for weights, fitness in zip(pop, vs_uniform):
+            fitness_dict[tuple(weights)] = fitness
+    else:
+        for weights in pop:
+            # It's in our memo
+            # if tuple(weights) in fitness_dict:
+            #    continue
+
+            def fxn(pos):
+                if cache is not None:
+                    return eh.cached_value_based_heuristic(pos, weights, cache)
+                return eh.value_based_heuristic(pos, weights)
+
+            #vs_random = eh.compare_heuristic(fxn, eh.random_heuristic, num_games, prob, depth)
+            vs_uniform = eh.compare_heuristic(fxn, eh.uniform_heuristic, num_games, prob, depth, cache = cache)
+            # print(f"vs_random: {vs_random}, vs_uniform: {vs_uniform}, vs_simple: {vs_simple}")
+            fitness_dict[tuple(weights)] = vs_uniform
 
     ret = nlargest(target_size, fitness_dict.keys(), key = fitness_dict.get)
     return list(map(lambda e: list(e), ret))
@@ -102,7 +126,8 @@ def mutate(pop, mutation_rate) -> None:
 def round_list_values(lst, num_places):
     return list(map(lambda x: round(x, num_places), lst))
 
-def breed(pop_size, num_generations, mutation_rate, num_games, prob, depth):
+def breed(pop_size, num_generations, mutation_rate, num_games, prob, depth, cache_path = None, shared_tree = False,
+          use_tournament = False, processes = 1):
     '''
     Breeds a population of pop_size across num_generations generations
     At the end, return the best weights to give each piece and its corresponding fitness
@@ -113,16 +138,24 @@ def breed(pop_size, num_generations, mutation_rate, num_games, prob, depth):
         their fitness, int
     prob --- Probability that the agents will not play randomly, float
     depth --- Depth of minimax search, int
+    cache_path --- Optional SQLite file that persists the position cache across runs, str
+    shared_tree --- If True, each generation is evaluated with one shared search tree per position, bool
+    use_tournament --- If True, each generation is ranked by a Swiss tournament, bool
+    processes --- Number of worker processes playing tournament games, int
     '''
     start = time()
     fitness_dict = {}
+    # Legal moves, results and material don't depend on the heuristic so
+    # every individual of every generation shares them
+    cache = PositionCache(path = cache_path)
     pop = random_population(pop_size)
 
     # While not done
     for i in range(num_generations):
         #print(f"Generation {i}:")
         #print("Evaluate each individual and select for crossover")
-        parents = select_most_fit(pop, fitness_dict, pop_size // 4, num_games, prob, depth)
+        parents = select_most_fit(pop, fitness_dict, pop_size // 4, num_games, prob, depth, cache, shared_tree,
+                                  use_tournament, processes)
         # print("Parents:", parents)
 
         '''
@@ -140,7 +173,8 @@ def breed(pop_size, num_generations, mutation_rate, num_games, prob, depth):
         
         #print("Select for survival")
         # We include parents in the pool because we want to be at least as good as our last generation
-        pop = select_most_fit(pop + offspring, fitness_dict, pop_size, num_games, prob, depth)
+        pop = select_most_fit(pop + offspring, fitness_dict, pop_size, num_games, prob, depth, cache, shared_tree,
+                              use_tournament, processes)
         
         '''
         print("-" * 50)
@@ -155,6 +189,7 @@ def breed(pop_size, num_generations, mutation_rate, num_games, prob, depth):
 
     best_weights = max(pop, key = lambda x: fitness_dict.get(tuple(x)))
     best_fitness = max([fitness_dict[tuple(w)] for w in pop])
+    cache.close()
     print(f"Breeding took {round(time() - start, 1)}s")
     return best_weights, best_fitness
 
@@ -162,7 +197,7 @@ def main():
     '''
     Handles command line input
 
-    Users should run: ./MicroChessGeneticAlgorithm pop_size num_generations mutation_rate num_games prob depth
+    Users should run: ./MicroChessGeneticAlgorithm pop_size num_generations mutation_rate num_games prob depth [cache_file]
     '''
     argv = sys.argv
 
@@ -172,6 +207,7 @@ def main():
     num_games = int(argv[4])
     prob = float(argv[5])
     depth = int(argv[6])
+    cache_path = argv[7] if len(argv) > 7 else None
 
     info = '''
 I am currently running {0} generations of genetic algorithms for a population size
@@ -184,7 +220,7 @@ This operation may take ~15 minutes.
     '''.format(num_generations, pop_size, mutation_rate, num_games, prob * 100)
     print(info)
 
-    best_weights, best_fitness = breed(pop_size, num_generations, mutation_rate, num_games, prob, depth)
+    best_weights, best_fitness = breed(pop_size, num_generations, mutation_rate, num_games, prob, depth, cache_path)
 
     info = '''
 I have finished running our evolutionary computation! I have determined the best weights
@@ -202,7 +238,10 @@ Here is my most fit heuristic's win percentage against completely random play ac
     def most_fit_fxn(pos):
         return eh.value_based_heuristic(pos, best_weights)
     
-    print(eh.compare_heuristic(most_fit_fxn, eh.random_heuristic, 1000, prob, depth))
+    if random_playout is not None:
+        print(random_playout.compare_with_random(most_fit_fxn, 1000, prob, depth))
+    else:
+        print(eh.compare_heuristic(most_fit_fxn, eh.random_heuristic, 1000, prob, depth))
 
     info = '''
 Here is my most fit heuristic's win percentage against a uniform heuristic where
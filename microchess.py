@@ -2,6 +2,15 @@ from piece import Piece, King, Queen, Rook, Bishop, Knight, Pawn, WHITE, BLACK,
 
 DRAW = 2
 
+PIECE_CLASSES = {
+    KING: King,
+    QUEEN: Queen,
+    ROOK: Rook,
+    BISHOP: Bishop,
+    KNIGHT: Knight,
+    PAWN: Pawn
+}
+
 class MicroChess:
     '''
     We have made several simplifications to make coding this game easier
@@ -102,6 +111,45 @@ class MicroChess:
 
             return MicroChess.Position(board_copy, self._turn, black_pieces_copy, white_pieces_copy, list(self._king_pos))
 
+        def encode(self) -> bytes:
+            '''
+            Returns a compact encoding of the position that can be cheaply sent between processes
+
+            Byte 0 is the turn and byte 1 the number of black pieces. Every piece then takes
+            one byte (piece_type << 5 | square) with the black pieces first, in the same
+            order as our piece lists so that decoding reproduces move ordering exactly
+            '''
+            # Encoding is done at every node of a cached search so we skip the getters
+            ret = [self._turn, len(self._black_pieces)]
+            for piece in self._black_pieces:
+                ret.append(piece.piece_type << 5 | piece.pos[0] * BOARD_WIDTH + piece.pos[1])
+            for piece in self._white_pieces:
+                ret.append(piece.piece_type << 5 | piece.pos[0] * BOARD_WIDTH + piece.pos[1])
+            return bytes(ret)
+
+        @staticmethod
+        def decode(encoding) -> 'Position':
+            '''
+            Returns the Position represented by encoding, as returned by encode
+            '''
+            turn, num_black = encoding[0], encoding[1]
+            board = [[None] * BOARD_WIDTH for _ in range(BOARD_LENGTH)]
+            black_pieces, white_pieces = [], []
+            king_pos = [None, None]
+            for i in range(2, len(encoding)):
+                color = BLACK if i - 2 < num_black else WHITE
+                piece_type, square = encoding[i] >> 5, encoding[i] & 31
+                row, col = square // BOARD_WIDTH, square % BOARD_WIDTH
+                piece = PIECE_CLASSES[piece_type](color, [row, col])
+                board[row][col] = piece
+                if color == BLACK:
+                    black_pieces.append(piece)
+                else:
+                    white_pieces.append(piece)
+                if piece_type == KING:
+                    king_pos[color] = [row, col]
+            return MicroChess.Position(board, turn, black_pieces, white_pieces, king_pos)
+
         def print_board(self) -> None:
             print("Current Board:")
             for row in range(BOARD_LENGTH):
@@ -127,16 +175,46 @@ class MicroChess:
             Returns a list of the legal moves that the player can make
             The list is 2 elements: the old position and new position
             '''
+            return list(self.iter_player_legal_moves())
+
+        def iter_player_legal_moves(self) -> 'Iterator':
+            '''
+            Lazily yields the legal moves that the player can make, in the same order
+            as player_legal_moves
+            Each move is only checked with would_be_check when it is requested, so
+            callers that stop at the first move skip the rest of the work
+            '''
             pieces = self._black_pieces if self._turn == BLACK else self._white_pieces
 
-            ret = []
             for piece in pieces:
-                dests = piece.get_legal_moves(self._board)
-                for dest in dests:
+                for dest in piece.get_legal_moves(self._board):
                     move = [piece.get_pos(), dest]
                     if not self.would_be_check(move):
-                        ret.append(move)
-            return ret
+                        yield move
+
+        def iter_player_captures(self) -> 'Iterator':
+            '''
+            Lazily yields the legal capturing moves that the player can make
+            Non-captures are skipped before the (expensive) would_be_check test
+            '''
+            pieces = self._black_pieces if self._turn == BLACK else self._white_pieces
+
+            for piece in pieces:
+                for dest in piece.get_legal_moves(self._board):
+                    if self._board[dest[0]][dest[1]] is None:
+                        continue
+                    move = [piece.get_pos(), dest]
+                    if not self.would_be_check(move):
+                        yield move
+
+        def has_legal_move(self) -> bool:
+            '''
+            Returns if the player has at least one legal move
+            Stops at the first legal move found
+            '''
+            for _ in self.iter_player_legal_moves():
+                return True
+            return False
 
         def print_player_legal_moves(self, moves) -> None:
             p = list(map(lambda m: [str(self._board[m[0][0]][m[0][1]]), m[1]], moves))
@@ -154,9 +232,7 @@ class MicroChess:
 
             op_pieces = self._black_pieces if color == WHITE else self._white_pieces
             for piece in op_pieces:
-                if piece.cant_check(king_pos):
-                    continue
-                if king_pos in piece.get_legal_moves(self._board):
+                if piece.attacks(self._board, king_pos):
                     return True
             return False
 
@@ -197,13 +273,7 @@ class MicroChess:
             Checks to see if there is a checkmate ie. the current player can't make a move
             that is not a check position
             '''
-            possible_moves = self.player_legal_moves()
-            if len(possible_moves) == 0:
-                return True
-            for move in possible_moves:
-                if not self.would_be_check(move):
-                    return False
-            return True
+            return not self.has_legal_move()
 
         def winner(self) -> int:
             '''
@@ -293,6 +363,8 @@ class MicroChess:
                     new_pos._black_pieces.remove(captured)
             # Conduct the move
             new_pos._board[old_x][old_y].move_to([new_x, new_y])
+            if new_pos._board[old_x][old_y].get_piece_type() == KING:
+                new_pos._king_pos[move_color] = [new_x, new_y]
             new_pos._board[new_x][new_y] = new_pos._board[old_x][old_y]
             new_pos._board[old_x][old_y] = None
 
@@ -1,15 +1,56 @@
+from multiprocessing import Pool
+from time import time
+
 from piece import BLACK, WHITE
-from microchess import DRAW
+from microchess import MicroChess, DRAW
+from position_cache import piece_types
+
+# PositionCache of a parallel_minimax worker process, set by the pool initializer
+_worker_cache = None
+
+def _init_worker(cache):
+    global _worker_cache
+    _worker_cache = cache
 
 class MiniMaxAgent:
 
-    def __init__(self, heuristic_fxn, depth):
+    def __init__(self, heuristic_fxn, depth, quiescence = False, max_quiescence_nodes = 500,
+                 capture_values = None, delta_margin = 0, processes = 1, cache = None, deadline = None):
         '''
         Initialize a minimax agent that plays games via heuristic_fxn
         heuristic_fxn --- a function that given a Position, returns an value
+        depth --- Depth of the full width minimax search
+        quiescence --- If True, leaves at depth 0 are extended with a capture-only search
+            so that we don't evaluate positions in the middle of an exchange
+        max_quiescence_nodes --- Maximum number of nodes a single quiescence search may visit,
+            after which it falls back to the static evaluation
+        capture_values --- List indexed by piece type giving an upper bound on how much
+            capturing that piece can change heuristic_fxn, used for delta pruning
+            Defaults to infinity for every piece, ie. no delta pruning, since a bound that is
+            too low for heuristic_fxn (eg. 1 for a rook under simple_heuristic) changes the result
+            See evaluate_heuristic.capture_values for the bounds of the built in heuristics
+        delta_margin --- Extra slack added to capture_values before delta pruning a capture
+        processes --- Number of worker processes used to search the root moves in parallel
+            heuristic_fxn must be picklable (ie. a module level function or functools.partial)
+            when processes > 1. The pool is kept between moves, so call close() or use the
+            agent in a with block when done
+        cache --- Optional PositionCache used for legal moves and game results
+            When processes > 1, each worker gets its own copy of the cache, which shares
+            the SQLite file if the cache has one
+        deadline --- Optional time.time() after which searches stop by raising TimeoutError
         '''
         self.heuristic_fxn = heuristic_fxn
         self.depth = depth
+        self.quiescence = quiescence
+        self.max_quiescence_nodes = max_quiescence_nodes
+        self.capture_values = capture_values if capture_values is not None else [float("inf")] * 6
+        self.delta_margin = delta_margin
+        self.processes = processes
+        self._pool = None
+        self.cache = cache
+        self.deadline = deadline
+        # Number of positions visited by the last call to choose_next_move
+        self.nodes = 0
 
     def choose_next_move(self, pos):
         '''
@@ -17,9 +58,117 @@ class MiniMaxAgent:
         This uses minimax
         pos --- Current position
         '''
-        best_val, best_move = self.minimax(pos, self.depth, self.heuristic_fxn)
+        self.nodes = 0
+        if self.processes > 1:
+            best_val, best_move = self.parallel_minimax(pos, self.depth, self.heuristic_fxn)
+        else:
+            best_val, best_move = self.minimax(pos, self.depth, self.heuristic_fxn)
         return best_move
-        
+
+    def parallel_minimax(self, pos, depth, heuristic_fxn):
+        '''
+        Same as minimax but the subtree under each root move is searched in a process pool
+        Children are sent to the workers as Position.encode() bytes and the root move is
+        chosen with the same tie breaking as minimax, so the result is identical
+
+        Returns [best_val, best_move]
+        '''
+        if depth == 0:
+            return self.minimax(pos, depth, heuristic_fxn)
+        self.nodes += 1
+        winner = self.winner(pos)
+        if winner != -1:
+            return [terminal_value(winner), None]
+
+        if self._pool is None:
+            self._pool = Pool(self.processes, _init_worker, (self.cache,))
+        moves = self.legal_moves(pos)
+        options = {
+            "quiescence": self.quiescence,
+            "max_quiescence_nodes": self.max_quiescence_nodes,
+            "capture_values": self.capture_values,
+            "delta_margin": self.delta_margin,
+            "deadline": self.deadline
+        }
+        jobs = [(pos.result_copy(move).encode(), heuristic_fxn, depth - 1, options) for move in moves]
+        results = self._pool.map(_search_encoded, jobs)
+
+        best_move = None
+        if pos.get_turn() == BLACK:
+            value = float("-inf")
+            for move, (child_val, child_nodes) in zip(moves, results):
+                self.nodes += child_nodes
+                if child_val >= value:
+                    value = child_val
+                    best_move = move
+        else:
+            value = float("inf")
+            for move, (child_val, child_nodes) in zip(moves, results):
+                self.nodes += child_nodes
+                if child_val <= value:
+                    value = child_val
+                    best_move = move
+        return [value, best_move]
+
+    def compare_parallel(self, pos):
+        '''
+        Runs both the serial and the parallel search on pos and reports the speedup
+        Raises ValueError if the two searches disagree
+
+        Returns a dict with the chosen move, both run times in seconds and the speedup
+        A pool started here (ie. when choose_next_move hasn't started one) is closed again
+        '''
+        start = time()
+        serial_val, serial_move = self.minimax(pos, self.depth, self.heuristic_fxn)
+        serial_time = time() - start
+
+        own_pool = self._pool is None
+        if own_pool:
+            self._pool = Pool(max(self.processes, 2), _init_worker, (self.cache,))
+        try:
+            start = time()
+            parallel_val, parallel_move = self.parallel_minimax(pos, self.depth, self.heuristic_fxn)
+            parallel_time = time() - start
+        finally:
+            if own_pool:
+                self.close()
+
+        if serial_val != parallel_val or serial_move != parallel_move:
+            raise ValueError("compare_parallel: parallel search disagrees with serial search")
+        return {
+            "move": serial_move,
+            "serial_time": serial_time,
+            "parallel_time": parallel_time,
+            "speedup": serial_time / parallel_time if parallel_time > 0 else float("inf")
+        }
+
+    def close(self):
+        '''
+        Shuts down the worker processes used by the parallel search, if any
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def winner(self, pos):
+        '''
+        Returns pos.winner(), through the cache if we have one
+        '''
+        return pos.winner() if self.cache is None else self.cache.winner(pos)
+
+    def legal_moves(self, pos):
+        '''
+        Returns pos.player_legal_moves(), through the cache if we have one
+        '''
+        return pos.player_legal_moves() if self.cache is None else self.cache.legal_moves(pos)
+
     def minimax(self, pos, depth, heuristic_fxn):
         '''
         We assume the values are relative to BLACK
@@ -27,21 +176,23 @@ class MiniMaxAgent:
 
         Returns [best_val, best_move]
         '''
-        if pos.winner() != -1:
-            if pos.winner() == DRAW:
-                return [0, None]
-            elif pos.winner() == BLACK:
-                return [float("inf"), None]
-            else:
-                return [float("-inf"), None]
-            
+        self.nodes += 1
+        if self.deadline is not None and time() > self.deadline:
+            raise TimeoutError("minimax: search ran past its deadline")
+        winner = self.winner(pos)
+        if winner != -1:
+            return [terminal_value(winner), None]
+
         if depth == 0:
+            if self.quiescence:
+                self.quiescence_nodes = 0
+                return [self.quiescence_search(pos, float("-inf"), float("inf"), heuristic_fxn), None]
             return [heuristic_fxn(pos), None]
-        
+
         best_move = None
         if pos.get_turn() == BLACK:
             value = float("-inf")
-            for move in pos.player_legal_moves():
+            for move in self.legal_moves(pos):
                 child_pos = pos.result_copy(move)
                 child_val = self.minimax(child_pos, depth - 1, heuristic_fxn)[0]
                 if child_val >= value:
@@ -50,10 +201,171 @@ class MiniMaxAgent:
             return [value, best_move]
         else:
             value = float("inf")
-            for move in pos.player_legal_moves():
+            for move in self.legal_moves(pos):
                 child_pos = pos.result_copy(move)
                 child_val = self.minimax(child_pos, depth - 1, heuristic_fxn)[0]
                 if child_val <= value:
                     value = child_val
                     best_move = move
-            return [value, best_move]
\ No newline at end of file
+            return [value, best_move]
+
+    def quiescence_search(self, pos, alpha, beta, heuristic_fxn):
+        '''
+        Capture-only alpha-beta search used in place of a static evaluation at depth 0
+        Values are relative to BLACK, as in minimax
+
+        The player to move may "stand pat" and take the static evaluation instead of capturing,
+        unless they are in check, in which case every legal move is searched. Captures that
+        can't bring the value back above alpha (below beta for WHITE) even when gaining
+        capture_values + delta_margin are pruned.
+        Once max_quiescence_nodes positions have been visited we stop extending.
+        '''
+        self.nodes += 1
+        self.quiescence_nodes += 1
+        if self.deadline is not None and time() > self.deadline:
+            raise TimeoutError("quiescence_search: search ran past its deadline")
+        winner = self.winner(pos)
+        if winner != -1:
+            return terminal_value(winner)
+
+        stand_pat = heuristic_fxn(pos)
+        if self.quiescence_nodes >= self.max_quiescence_nodes:
+            return stand_pat
+
+        # In check there is no standing pat, every evasion is searched instead of only captures
+        in_check = pos.is_check()
+        moves = pos.player_legal_moves() if in_check else pos.iter_player_captures()
+        board = pos.get_board()
+        if pos.get_turn() == BLACK:
+            value = float("-inf")
+            if not in_check:
+                if stand_pat >= beta:
+                    return stand_pat
+                alpha = max(alpha, stand_pat)
+                value = stand_pat
+            for move in moves:
+                captured = board[move[1][0]][move[1][1]]
+                # Delta pruning
+                if not in_check and stand_pat + self.capture_values[captured.get_piece_type()] + self.delta_margin <= alpha:
+                    continue
+                child_val = self.quiescence_search(pos.result_copy(move), alpha, beta, heuristic_fxn)
+                value = max(value, child_val)
+                alpha = max(alpha, value)
+                if alpha >= beta:
+                    break
+            return value
+        else:
+            value = float("inf")
+            if not in_check:
+                if stand_pat <= alpha:
+                    return stand_pat
+                beta = min(beta, stand_pat)
+                value = stand_pat
+            for move in moves:
+                captured = board[move[1][0]][move[1][1]]
+                # Delta pruning
+                if not in_check and stand_pat - self.capture_values[captured.get_piece_type()] - self.delta_margin >= beta:
+                    continue
+                child_val = self.quiescence_search(pos.result_copy(move), alpha, beta, heuristic_fxn)
+                value = min(value, child_val)
+                beta = min(beta, value)
+                if alpha >= beta:
+                    break
+            return value
+
+class BatchMiniMaxAgent:
+
+    def __init__(self, weights_list, depth, cache = None):
+        '''
+        Initialize an agent that plays for K value based heuristics at once
+        Every heuristic searches the same tree (legal moves, children and results don't
+        depend on the weights) so we walk it once and back up a list of K values per node
+
+        weights_list --- List of K weight lists as taken by value_based_heuristic
+        depth --- Depth of minimax search
+        cache --- Optional PositionCache used for legal moves, game results and material
+        '''
+        self.weights_list = [[0, 0] + list(weights) for weights in weights_list]
+        self.depth = depth
+        self.cache = cache
+        self.nodes = 0
+
+    def choose_next_moves(self, pos, indices = None):
+        '''
+        Returns the move that MiniMaxAgent would choose in pos for each heuristic
+        indices --- Optional list of which heuristics to search for, defaults to all of them
+        '''
+        self.nodes = 0
+        weights_list = self.weights_list if indices is None else [self.weights_list[k] for k in indices]
+        best_vals, best_moves = self.batch_minimax(pos, self.depth, weights_list)
+        return best_moves
+
+    def batch_minimax(self, pos, depth, weights_list):
+        '''
+        Same as MiniMaxAgent.minimax for every weights in weights_list at once
+        Values are relative to BLACK
+
+        Returns [best_vals, best_moves], each a list with one entry per weights
+        '''
+        self.nodes += 1
+        num_heuristics = len(weights_list)
+        winner = pos.winner() if self.cache is None else self.cache.winner(pos)
+        if winner != -1:
+            return [[terminal_value(winner)] * num_heuristics, [None] * num_heuristics]
+
+        if depth == 0:
+            black_types, white_types = piece_types(pos) if self.cache is None else self.cache.material(pos)
+            values = []
+            for weights in weights_list:
+                # Same sum, in the same order, as value_based_heuristic
+                black_pieces_value, white_pieces_value = 0, 0
+                for piece_type in black_types:
+                    black_pieces_value += weights[piece_type]
+                for piece_type in white_types:
+                    white_pieces_value += weights[piece_type]
+                values.append(black_pieces_value - white_pieces_value)
+            return [values, [None] * num_heuristics]
+
+        best_moves = [None] * num_heuristics
+        moves = pos.player_legal_moves() if self.cache is None else self.cache.legal_moves(pos)
+        if pos.get_turn() == BLACK:
+            values = [float("-inf")] * num_heuristics
+            for move in moves:
+                child_vals = self.batch_minimax(pos.result_copy(move), depth - 1, weights_list)[0]
+                for k in range(num_heuristics):
+                    if child_vals[k] >= values[k]:
+                        values[k] = child_vals[k]
+                        best_moves[k] = move
+        else:
+            values = [float("inf")] * num_heuristics
+            for move in moves:
+                child_vals = self.batch_minimax(pos.result_copy(move), depth - 1, weights_list)[0]
+                for k in range(num_heuristics):
+                    if child_vals[k] <= values[k]:
+                        values[k] = child_vals[k]
+                        best_moves[k] = move
+        return [values, best_moves]
+
+def _search_encoded(args):
+    '''
+    Worker for parallel_minimax: searches the encoded position and returns [value, nodes]
+    The worker's cache is flushed after every job so that its entries reach the SQLite file
+    even though the worker is never told when the pool shuts down
+    '''
+    encoding, heuristic_fxn, depth, options = args
+    agent = MiniMaxAgent(heuristic_fxn, depth, cache = _worker_cache, **options)
+    value = agent.minimax(MicroChess.Position.decode(encoding), depth, heuristic_fxn)[0]
+    if _worker_cache is not None:
+        _worker_cache.flush()
+    return [value, agent.nodes]
+
+def terminal_value(winner):
+    '''
+    Returns the value relative to BLACK of a finished game given pos.winner()
+    '''
+    if winner == DRAW:
+        return 0
+    elif winner == BLACK:
+        return float("inf")
+    else:
+        return float("-inf")
@@ -22,7 +22,7 @@ class Piece():
         color --- BLACK, WHITE
         pos --- position on board (row, col) starting from upper corner
         type --- piece type
-        legal_moves --- function that given a position returns a list of legal moves
+        legal_moves --- generator function that given a position yields the legal moves
         cant_check_fxn(pos, king_pos) --- function that returns True if there is a shortcircuit way to know
             that the piece at pos can't check the opposing king at king_pos
         '''
@@ -43,8 +43,27 @@ class Piece():
         '''
         Given a board (6x6) matrix, returns what moves are legal to get to
         '''
+        return list(self.legal_moves(self.pos, board))
+
+    def iter_legal_moves(self, board):
+        '''
+        Lazily yields the moves that are legal to get to
+        Callers that only need the first hit (eg. attack tests) can stop early
+        '''
         return self.legal_moves(self.pos, board)
 
+    def attacks(self, board, target):
+        '''
+        Returns if the piece could move to (capture on) target
+        Stops generating moves as soon as target is found
+        '''
+        if self.cant_check(target):
+            return False
+        for dest in self.iter_legal_moves(board):
+            if dest == target:
+                return True
+        return False
+
     def get_piece_type(self):
         return self.piece_type
 
@@ -80,36 +99,32 @@ We define positive y-axis as increasing column
 
 def continuous_legal_moves(pos, board, directions):
     '''
-    Return legal moves for pieces that move continuously ie rook, queen, bishop
+    Yield legal moves for pieces that move continuously ie rook, queen, bishop
     These pieces can move in their respective directions until either out of bounds
     or they hit another piece
     '''
     piece_color = board[pos[0]][pos[1]].get_color()
-    ret = []
     for dx, dy in directions:
         x, y = pos[0] + dx, pos[1] + dy
         while 0 <= x < BOARD_LENGTH and 0 <= y < BOARD_WIDTH and (board[x][y] is None or board[x][y].get_color() != piece_color):
-            ret.append([x, y])
+            yield [x, y]
             # We found another piece so we must not go further
             if board[x][y] is not None:
                 break
             x += dx
             y += dy
-    return ret
 
 class King(Piece):
     def __init__(self, color, pos):
         def king_legal_moves(pos, board):
             piece_color = board[pos[0]][pos[1]].get_color()
-            ret = []
             # All directions as long as they are 1 away
             directions = STRAIGHT_DIRECTIONS + DIAGONAL_DIRECTIONS
             for dx, dy in directions:
                 x, y = pos[0] + dx, pos[1] + dy
                 # Add check for check
                 if 0 <= x < BOARD_LENGTH and 0 <= y < BOARD_WIDTH and (board[x][y] is None or board[x][y].get_color() != piece_color):
-                    ret.append([x, y])
-            return ret
+                    yield [x, y]
 
         def cant_check_fxn(pos, king_pos):
             '''
@@ -161,14 +176,12 @@ class Knight(Piece):
     def __init__(self, color, pos):
         def knight_legal_moves(pos, board):
             piece_color = board[pos[0]][pos[1]].get_color()
-            ret = []
             # All directions as long as they are 1 away
             directions = [[-1, 2], [2, -1], [-1, -2], [-2, -1], [2, 1], [1, 2], [-2, 1], [1, -2]]
             for dx, dy in directions:
                 x, y = pos[0] + dx, pos[1] + dy
                 if 0 <= x < BOARD_LENGTH and 0 <= y < BOARD_WIDTH and (board[x][y] is None or board[x][y].get_color() != piece_color):
-                    ret.append([x, y])
-            return ret
+                    yield [x, y]
         def cant_check_fxn(pos, king_pos):
             '''
             Returns if the piece at pos can check the king at king_pos
@@ -180,7 +193,6 @@ class Knight(Piece):
 class Pawn(Piece):
     def __init__(self, color, pos):
         def pawn_legal_moves(pos, board):
-            ret = []
             x, y = pos[0], pos[1]
             piece_color = board[x][y].get_color()
             # At the beginning, pawns can possibly move up 2 spaces
@@ -193,9 +205,9 @@ class Pawn(Piece):
             '''
             # Can move forward 1 as long as it's empty
             if color == BLACK and 0 <= x+1 < BOARD_LENGTH and board[x+1][y] is None:
-                ret.append([x+1, y])
+                yield [x+1, y]
             if color == WHITE and 0 <= x-1 < BOARD_LENGTH and board[x-1][y] is None:
-                ret.append([x-1, y])
+                yield [x-1, y]
             # Can move diagonal while capturing
             capture_directions = [[1, -1], [1, -1]]
             for dx, dy in capture_directions:
@@ -203,8 +215,7 @@ class Pawn(Piece):
                     dx = -1
                 new_x, new_y = x + dx, y + dy
                 if 0 <= new_x < BOARD_LENGTH and 0 <= new_y < BOARD_WIDTH and board[new_x][new_y] is not None and board[new_x][new_y].get_color() != piece_color:
-                    ret.append([new_x, new_y])
-            return ret
+                    yield [new_x, new_y]
         def cant_check_fxn(pos, king_pos):
             '''
             Returns if the piece at pos can check the king at king_pos
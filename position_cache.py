@@ -0,0 +1,203 @@
+from collections import OrderedDict
+import sqlite3
+from time import time
+
+from piece import BLACK, WHITE, BOARD_WIDTH
+from microchess import DRAW
+
+# Bump whenever the layout of the SQLite file changes, older files are cleared
+CACHE_FORMAT = 2
+
+class PositionCache:
+    '''
+    Cache of the heuristic independent work done for a position: its legal moves,
+    its winner and its material (the piece types of each player). Each of these is
+    only computed when first asked for
+
+    Entries are keyed by Position.encode() and kept in an in-memory LRU of at most
+    max_entries positions. If path is given, entries are also stored in an SQLite file
+    so that they persist across runs and can be shared by parallel worker processes.
+    '''
+
+    def __init__(self, max_entries = 200000, path = None, max_disk_entries = 5000000):
+        '''
+        max_entries --- Maximum number of positions kept in memory, int
+        path --- Optional SQLite file backing the cache, str
+        max_disk_entries --- Maximum number of positions kept in the SQLite file, int
+        '''
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._db = None
+        # Rows to write and keys to mark as used, flushed together in one short transaction
+        # so that other processes sharing the file are never locked out for long
+        self._pending_rows = {}
+        self._pending_used = set()
+        self.hits, self.misses = 0, 0
+
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout = 60, isolation_level = None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("BEGIN IMMEDIATE")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != CACHE_FORMAT:
+                self._db.execute("DROP TABLE IF EXISTS positions")
+                self._db.execute("DROP TABLE IF EXISTS meta")
+                self._db.execute(f"PRAGMA user_version = {CACHE_FORMAT}")
+            self._db.execute('''CREATE TABLE IF NOT EXISTS positions (
+                key BLOB PRIMARY KEY, moves BLOB, winner INTEGER, material BLOB, used REAL)''')
+            self._db.execute("CREATE INDEX IF NOT EXISTS positions_used ON positions (used)")
+            # Number of rows in positions, kept up to date by every process so flushes never count them
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            self._db.execute("INSERT OR IGNORE INTO meta SELECT 'rows', COUNT(*) FROM positions")
+            self._db.execute("COMMIT")
+            self._db.isolation_level = ""
+
+    def __getstate__(self):
+        # Only the configuration is sent to other processes, they reopen the SQLite file
+        return (self.max_entries, self.path, self.max_disk_entries)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def legal_moves(self, pos) -> 'List':
+        '''
+        Returns pos.player_legal_moves()
+        The returned list is shared with the cache and must not be mutated
+        '''
+        key, entry = self.lookup(pos)
+        if entry[0] is None:
+            entry[0] = pos.player_legal_moves()
+            self._store(key, entry)
+        return entry[0]
+
+    def winner(self, pos) -> int:
+        '''
+        Returns pos.winner()
+        '''
+        key, entry = self.lookup(pos)
+        if entry[1] is None:
+            # pos.winner() stops at the first legal move so it is cheaper than
+            # generating every move when we don't have them yet
+            entry[1] = pos.winner() if entry[0] is None else winner_from_moves(pos, entry[0])
+            self._store(key, entry)
+        return entry[1]
+
+    def material(self, pos) -> 'Tuple':
+        '''
+        Returns (black_types, white_types), the piece types of each player's pieces
+        in the order of pos's piece lists (see piece_types)
+        '''
+        key, entry = self.lookup(pos)
+        if entry[2] is None:
+            entry[2] = piece_types(pos)
+            self._store(key, entry)
+        return entry[2]
+
+    def lookup(self, pos) -> 'Tuple':
+        '''
+        Returns (key, entry) for pos where entry is [legal_moves, winner, material]
+        Fields that haven't been computed yet are None
+        '''
+        key = pos.encode()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return key, entry
+
+        self.misses += 1
+        entry = self._load(key) if self._db is not None else None
+        if entry is None:
+            entry = [None, None, None]
+        self._entries[key] = entry
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last = False)
+        return key, entry
+
+    def _load(self, key):
+        row = self._db.execute("SELECT moves, winner, material FROM positions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._pending_used.add(key)
+        self._maybe_flush()
+        moves, winner, material = row
+        if moves is not None:
+            moves = [[[moves[i] // BOARD_WIDTH, moves[i] % BOARD_WIDTH],
+                      [moves[i + 1] // BOARD_WIDTH, moves[i + 1] % BOARD_WIDTH]] for i in range(0, len(moves), 2)]
+        if material is not None:
+            material = (tuple(material[1:material[0] + 1]), tuple(material[material[0] + 1:]))
+        return [moves, winner, material]
+
+    def _store(self, key, entry):
+        if self._db is None:
+            return
+        moves, winner, material = entry
+        if moves is not None:
+            moves = bytes(sq[0] * BOARD_WIDTH + sq[1] for move in moves for sq in move)
+        if material is not None:
+            material = bytes((len(material[0]),) + material[0] + material[1])
+        self._pending_rows[key] = (key, moves, winner, material)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._pending_rows) + len(self._pending_used) >= 1000:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes pending rows to the SQLite file and evicts the least recently used rows
+        when the file has grown past max_disk_entries
+        '''
+        if self._db is None or not (self._pending_rows or self._pending_used):
+            return
+        now = time()
+        with self._db:
+            # Keep fields that another process may have filled in that we haven't
+            self._db.executemany('''UPDATE positions SET moves = COALESCE(?, moves), winner = COALESCE(?, winner),
+                material = COALESCE(?, material), used = ? WHERE key = ?''',
+                                 [(moves, winner, material, now, key)
+                                  for key, moves, winner, material in self._pending_rows.values()])
+            inserted = self._db.executemany("INSERT OR IGNORE INTO positions VALUES (?, ?, ?, ?, ?)",
+                                            [row + (now,) for row in self._pending_rows.values()]).rowcount
+            self._db.executemany("UPDATE positions SET used = ? WHERE key = ?",
+                                 [(now, key) for key in self._pending_used])
+            num_rows = self._db.execute("UPDATE meta SET value = value + ? WHERE name = 'rows' RETURNING value",
+                                        (inserted,)).fetchone()[0]
+            if num_rows > self.max_disk_entries:
+                deleted = self._db.execute('''DELETE FROM positions WHERE key IN
+                    (SELECT key FROM positions ORDER BY used LIMIT ?)''', (num_rows - self.max_disk_entries,)).rowcount
+                self._db.execute("UPDATE meta SET value = value - ? WHERE name = 'rows'", (deleted,))
+        self._pending_rows.clear()
+        self._pending_used.clear()
+
+    def close(self):
+        '''
+        Flushes and closes the SQLite file, if any
+        '''
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+def winner_from_moves(pos, moves) -> int:
+    '''
+    Returns pos.winner() given the already generated pos.player_legal_moves()
+    '''
+    if len(moves) == 0:
+        return BLACK if pos.get_turn() == WHITE else WHITE
+    if len(pos.get_black_pieces()) == 1 and len(pos.get_white_pieces()) == 1:
+        return DRAW
+    return -1
+
+def piece_types(pos) -> 'Tuple':
+    '''
+    Returns (black_types, white_types), the piece type of each player's pieces in list order
+    Keeping the order (rather than counting each type) lets value based heuristics add up
+    the same floats in the same order as value_based_heuristic, so their ties break the same way
+    '''
+    return (tuple(piece.get_piece_type() for piece in pos.get_black_pieces()),
+            tuple(piece.get_piece_type() for piece in pos.get_white_pieces()))
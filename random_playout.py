@@ -0,0 +1,256 @@
+import numpy as np
+
+from piece import BLACK, WHITE, KING, BOARD_LENGTH, BOARD_WIDTH
+from microchess import MicroChess, DRAW, PIECE_CLASSES
+from mini_max_agent import MiniMaxAgent
+from engine_tables import NUM_SQUARES, QUIET_ONLY, CAPTURE_ONLY, DEFAULT_PATH, piece_code, load_tables
+
+def position_to_board(pos) -> 'Tuple':
+    '''
+    Returns (board, turn) for a Position, where board is an array of NUM_SQUARES piece codes
+    '''
+    board = np.zeros(NUM_SQUARES, dtype = np.int8)
+    for piece in pos.get_black_pieces() + pos.get_white_pieces():
+        row, col = piece.get_pos()
+        board[row * BOARD_WIDTH + col] = piece_code(piece.get_color(), piece.get_piece_type())
+    return board, pos.get_turn()
+
+def position_to_order(pos) -> 'ndarray':
+    '''
+    Returns an array of NUM_SQUARES giving the index of the piece on each square in
+    pos's piece lists (black pieces first), -1 for empty squares
+    Move ordering, and so minimax tie breaking, depends on this order
+    '''
+    order = np.full(NUM_SQUARES, -1, dtype = np.int8)
+    for i, piece in enumerate(pos.get_black_pieces() + pos.get_white_pieces()):
+        row, col = piece.get_pos()
+        order[row * BOARD_WIDTH + col] = i
+    return order
+
+def board_to_position(board, turn, order = None) -> 'Position':
+    '''
+    Returns the Position for a board array and turn
+    Pieces are listed in the order given by order (see position_to_order), or in board order
+    '''
+    pos_board = [[None] * BOARD_WIDTH for _ in range(BOARD_LENGTH)]
+    black_pieces, white_pieces = [], []
+    king_pos = [None, None]
+    squares = np.flatnonzero(board)
+    if order is not None:
+        squares = squares[np.argsort(order[squares])]
+    for square in squares:
+        code = int(board[square]) - 1
+        color, piece_type = code // 6, code % 6
+        row, col = int(square) // BOARD_WIDTH, int(square) % BOARD_WIDTH
+        piece = PIECE_CLASSES[piece_type](color, [row, col])
+        pos_board[row][col] = piece
+        (black_pieces if color == BLACK else white_pieces).append(piece)
+        if piece_type == KING:
+            king_pos[color] = [row, col]
+    return MicroChess.Position(pos_board, int(turn), black_pieces, white_pieces, king_pos)
+
+class RandomPlayoutEngine:
+    '''
+    Plays random MicroChess moves for a whole batch of games at once
+
+    Boards are int8 arrays of shape (num_games, NUM_SQUARES) holding piece codes and turns
+    are arrays of shape (num_games,). Move generation, legality and terminal detection are
+    vectorized across the batch using precomputed move templates, and sampled moves are
+    uniform over each game's legal moves, like random.choice(pos.player_legal_moves())
+    '''
+
+    def __init__(self, seed = None, tables_path = DEFAULT_PATH):
+        '''
+        seed --- Optional seed for the random moves
+        tables_path --- Cache file of the move and attack tables (see engine_tables.load_tables),
+            None to generate them
+        '''
+        self.rng = np.random.default_rng(seed)
+        tables = load_tables(tables_path)
+        # Move templates of each color, only those of the player to move are ever looked at
+        self.templates = [tuple(tables[f"{name}_{color}"] for name in ("from_squares", "to_squares", "codes", "paths", "kinds"))
+                          for color in (BLACK, WHITE)]
+        # For each color and square, the templates of the other color that capture on that square
+        self.attack_from = tables["attack_from"]
+        self.attack_codes = tables["attack_codes"]
+        self.attack_paths = tables["attack_paths"]
+
+    def initial_boards(self, num_games) -> 'Tuple':
+        '''
+        Returns (boards, turns) for num_games games at the initial position
+        '''
+        board, turn = position_to_board(MicroChess().initial_pos())
+        return np.tile(board, (num_games, 1)), np.full(num_games, turn, dtype = np.int8)
+
+    def _extend(self, boards):
+        return np.concatenate([boards, np.zeros((len(boards), 1), dtype = np.int8)], axis = 1)
+
+    def pseudo_legal_mask(self, boards, color) -> 'ndarray':
+        '''
+        Returns a (num_games, num_templates) mask over self.templates[color] of the moves color
+        could make ignoring whether they leave their own king in check
+        '''
+        from_squares, to_squares, codes, paths, kinds = self.templates[color]
+        extended = self._extend(boards)
+        mask = extended[:, from_squares] == codes
+        mask &= (extended[:, paths] == 0).all(axis = 2)
+        targets = boards[:, to_squares]
+        empty = targets == 0
+        enemy = ~empty & ((targets - 1) // 6 != color)
+        mask &= np.where(kinds == QUIET_ONLY, empty, np.where(kinds == CAPTURE_ONLY, enemy, empty | enemy))
+        return mask
+
+    def in_check(self, boards, colors) -> 'ndarray':
+        '''
+        Returns whether the king of colors[i] is attacked on boards[i], for each game
+        '''
+        king_squares = np.argmax(boards == piece_code(colors, KING)[:, None], axis = 1)
+        rows = np.arange(len(boards))[:, None]
+        extended = self._extend(boards)
+        attacked = extended[rows, self.attack_from[colors, king_squares]] == self.attack_codes[colors, king_squares]
+        paths = self.attack_paths[colors, king_squares]
+        attacked &= (extended[rows[:, :, None], paths] == 0).all(axis = 2)
+        return attacked.any(axis = 1)
+
+    def apply_moves(self, boards, from_squares, to_squares, empty = 0) -> 'ndarray':
+        '''
+        Returns copies of boards with each game's move made
+        empty --- Value of an empty square, -1 for piece order arrays
+        '''
+        rows = np.arange(len(boards))
+        new_boards = boards.copy()
+        new_boards[rows, to_squares] = boards[rows, from_squares]
+        new_boards[rows, from_squares] = empty
+        return new_boards
+
+    def sample_moves(self, boards, turns) -> 'Tuple':
+        '''
+        Samples a uniformly random legal move for each game
+        Returns (from_squares, to_squares, has_move) where has_move is False for games
+        in which the player to move has no legal move
+
+        Moves are drawn uniformly from the pseudo-legal ones and redrawn if they leave
+        the king in check, which keeps the distribution uniform over the legal moves
+        '''
+        num_games = len(boards)
+        froms, tos = np.zeros(num_games, dtype = np.intp), np.zeros(num_games, dtype = np.intp)
+        has_move = np.zeros(num_games, dtype = bool)
+        for color in (BLACK, WHITE):
+            games = np.flatnonzero(turns == color)
+            if len(games) == 0:
+                continue
+            from_squares, to_squares = self.templates[color][:2]
+            candidates = self.pseudo_legal_mask(boards[games], color)
+            counts = candidates.sum(axis = 1)
+            searching = np.flatnonzero(counts > 0)
+            while len(searching) > 0:
+                # Pick the r-th remaining candidate of each game
+                r = (self.rng.random(len(searching)) * counts[searching]).astype(np.intp)
+                picks = np.argmax(np.cumsum(candidates[searching], axis = 1) > r[:, None], axis = 1)
+                moved = self.apply_moves(boards[games[searching]], from_squares[picks], to_squares[picks])
+                legal = ~self.in_check(moved, np.full(len(searching), color))
+
+                done = games[searching[legal]]
+                froms[done], tos[done], has_move[done] = from_squares[picks[legal]], to_squares[picks[legal]], True
+                candidates[searching[~legal], picks[~legal]] = False
+                counts[searching[~legal]] -= 1
+                searching = searching[~legal]
+                searching = searching[counts[searching] > 0]
+        return froms, tos, has_move
+
+    def step(self, boards, turns, winners, from_squares = None, to_squares = None, override = None,
+             orders = None) -> None:
+        '''
+        Plays one ply in every unfinished game (winners == -1), in place
+        Games where the player to move has no legal move are won by the other player
+        and games with only the two kings left are drawn, as in Position.winner
+
+        from_squares, to_squares, override --- optional moves to play instead of random ones
+            in the games where override is True
+        orders --- optional piece order arrays (see position_to_order) kept up to date with the moves
+        '''
+        active = np.flatnonzero(winners == -1)
+        if len(active) == 0:
+            return
+        froms, tos, has_move = self.sample_moves(boards[active], turns[active])
+        if override is not None:
+            froms = np.where(override[active], from_squares[active], froms)
+            tos = np.where(override[active], to_squares[active], tos)
+
+        winners[active[~has_move]] = 1 - turns[active[~has_move]]
+        only_kings = (boards[active] != 0).sum(axis = 1) == 2
+        winners[active[has_move & only_kings]] = DRAW
+
+        playing = has_move & ~only_kings
+        rows = active[playing]
+        boards[rows] = self.apply_moves(boards[rows], froms[playing], tos[playing])
+        if orders is not None:
+            orders[rows] = self.apply_moves(orders[rows], froms[playing], tos[playing], -1)
+        turns[rows] = 1 - turns[rows]
+
+    def playout(self, boards, turns, max_plies = None) -> 'ndarray':
+        '''
+        Plays random moves in every game until it is over and returns the winners
+        (BLACK, WHITE or DRAW). boards and turns are updated in place
+        Games still going after max_plies are counted as draws
+        '''
+        winners = np.full(len(boards), -1, dtype = np.int8)
+        plies = 0
+        while (winners == -1).any() and (max_plies is None or plies < max_plies):
+            self.step(boards, turns, winners)
+            plies += 1
+        winners[winners == -1] = DRAW
+        return winners
+
+    def random_games(self, num_games, max_plies = None) -> 'ndarray':
+        '''
+        Returns the winners of num_games completely random games from the initial position
+        '''
+        boards, turns = self.initial_boards(num_games)
+        return self.playout(boards, turns, max_plies)
+
+def compare_with_random(heuristic_fxn, num_games, prob, depth, seed = None) -> float:
+    '''
+    Same as compare_heuristic(heuristic_fxn, random_heuristic, num_games, prob, depth) but all
+    games are played at once: every random move in the batch is sampled by one vectorized
+    RandomPlayoutEngine step and the minimax moves are searched once per distinct position
+    Return the win percentage of heuristic_fxn
+
+    heuristic_fxn --- function that given Position returns a value
+    num_games --- the number of games to play, int
+    prob --- Probability that our agent will not play randomly
+    depth --- Depth of minimax search
+    seed --- Optional seed for the random moves
+    '''
+    engine = RandomPlayoutEngine(seed)
+    agent = MiniMaxAgent(heuristic_fxn, depth)
+    boards, turns = engine.initial_boards(num_games)
+    # Positions are rebuilt with compare_heuristic's piece order so that ties break the same way
+    orders = np.tile(position_to_order(MicroChess().initial_pos()), (num_games, 1))
+    winners = np.full(num_games, -1, dtype = np.int8)
+    # Like compare_heuristic, our agent plays BLACK in even games
+    agent_colors = np.arange(num_games) % 2
+    from_squares = np.zeros(num_games, dtype = np.intp)
+    to_squares = np.zeros(num_games, dtype = np.intp)
+    # Our agent always makes the same move in the same position, and many games
+    # pass through the same positions, so each position is only searched once
+    agent_moves = {}
+
+    while (winners == -1).any():
+        override = (winners == -1) & (turns == agent_colors) & (engine.rng.random(num_games) < prob)
+        for game in np.flatnonzero(override):
+            key = (boards[game].tobytes(), orders[game].tobytes(), int(turns[game]))
+            if key not in agent_moves:
+                agent_moves[key] = agent.choose_next_move(board_to_position(boards[game], turns[game], orders[game]))
+            move = agent_moves[key]
+            # The game is over, engine.step will score it
+            if move is None:
+                override[game] = False
+                continue
+            from_squares[game] = move[0][0] * BOARD_WIDTH + move[0][1]
+            to_squares[game] = move[1][0] * BOARD_WIDTH + move[1][1]
+        engine.step(boards, turns, winners, from_squares, to_squares, override, orders)
+
+    wins = (winners == agent_colors).sum()
+    draws = (winners == DRAW).sum()
+    return float(wins + draws / 2) / num_games
@@ -0,0 +1,579 @@
+from collections import OrderedDict
+import sqlite3
+import sys
+from time import time
+
+from piece import BLACK, WHITE, BOARD_WIDTH
+from microchess import MicroChess, DRAW
+from position_cache import winner_from_moves
+
+# Game theoretic values, relative to the player to move
+WIN = 1
+LOSS = -1
+# Positions whose value is still NULL when the retrograde analysis finishes are draws
+DRAWN = 0
+
+# Proof and disproof number of a position that is solved the other way
+INFINITY = 10 ** 9
+
+# Bits of a Position.encode() piece byte that hold its square
+SQUARE_MASK = 31
+
+def canonical_key(pos) -> bytes:
+    '''
+    Returns a key for pos that doesn't depend on the order of the piece lists
+    ie. Position.encode() with each player's piece bytes sorted
+    '''
+    encoding = pos.encode()
+    num_black = encoding[1]
+    return encoding[:2] + bytes(sorted(encoding[2:2 + num_black])) + bytes(sorted(encoding[2 + num_black:]))
+
+def child_key(key, move) -> bytes:
+    '''
+    Returns canonical_key(pos.result_copy(move)) given canonical_key(pos), without building
+    the child position. Moves only relocate the moving piece's square and remove a captured piece
+    '''
+    turn, num_black = key[0], key[1]
+    pieces = [list(key[2:2 + num_black]), list(key[2 + num_black:])]
+    from_square = move[0][0] * BOARD_WIDTH + move[0][1]
+    to_square = move[1][0] * BOARD_WIDTH + move[1][1]
+    movers, others = pieces[turn], pieces[1 - turn]
+    for i in range(len(movers)):
+        if movers[i] & SQUARE_MASK == from_square:
+            movers[i] = movers[i] & ~SQUARE_MASK | to_square
+            break
+    pieces[1 - turn] = [piece for piece in others if piece & SQUARE_MASK != to_square]
+    return bytes([1 - turn, len(pieces[BLACK])]) + bytes(sorted(pieces[BLACK])) + bytes(sorted(pieces[WHITE]))
+
+class Solver:
+    '''
+    Solves MicroChess positions by retrograde analysis over a disk backed position store
+
+    Each solve runs in two phases, both in batches that are committed atomically so that
+    an interrupted run can be resumed by creating a Solver on the same file:
+        1. Expansion: every position reachable from the root is stored along with the
+           edges to its children. Terminal positions get their value straight away
+        2. Retrograde: resolved positions are propagated to their parents in order of
+           plies to the end of the game. A parent is a WIN if any child is a LOSS and a
+           LOSS once every child is a WIN. Whatever is left unresolved is a draw
+    Only one batch of positions is ever held in memory.
+
+    Positions are solved in generations: solve_position adds a new root to the store and
+    only expands the positions of its subtree that earlier generations haven't stored yet.
+    Those are already solved, so values are only propagated to parents of the current generation.
+    '''
+
+    def __init__(self, path, root = None, batch_size = 10000):
+        '''
+        path --- SQLite file storing the positions, str
+        root --- Position solved by solve(), defaults to the initial position
+            Ignored when resuming a file that already has a root
+        batch_size --- Number of positions processed per transaction, int
+        '''
+        self.batch_size = batch_size
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB);
+            CREATE TABLE IF NOT EXISTS positions (key BLOB PRIMARY KEY, generation INTEGER, expanded INTEGER DEFAULT 0,
+                value INTEGER, plies INTEGER, unresolved INTEGER, propagated INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS edges (parent BLOB, child BLOB);
+            CREATE INDEX IF NOT EXISTS edges_child ON edges (child);
+            CREATE INDEX IF NOT EXISTS positions_unexpanded ON positions (expanded) WHERE expanded = 0;
+            CREATE INDEX IF NOT EXISTS positions_queue ON positions (plies)
+                WHERE propagated = 0 AND value IS NOT NULL;
+            CREATE TEMP TABLE batch (key BLOB PRIMARY KEY, value INTEGER);
+        ''')
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'root'").fetchone()
+        if row is None:
+            if root is None:
+                root = MicroChess().initial_pos()
+            self.root = canonical_key(root)
+            with self._db:
+                self._db.execute("INSERT INTO meta VALUES ('root', ?)", (self.root,))
+                self._db.execute("INSERT INTO meta VALUES ('generation', 0)")
+        else:
+            self.root = row[0]
+        self.generation = self._db.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+        # Whether the current generation is known to be fully solved
+        self._complete = False
+
+    def solve(self, verbose = False) -> 'Tuple':
+        '''
+        Runs (or resumes) both phases and returns [winner, best_line] for the root,
+        where winner is BLACK, WHITE or DRAW
+        '''
+        self.solve_position(MicroChess.Position.decode(self.root), verbose)
+        return [self.winner(), self.best_line()]
+
+    def solve_position(self, pos, verbose = False) -> int:
+        '''
+        Returns the value of pos relative to the player to move: WIN, LOSS or DRAWN
+        Positions that aren't in the store yet are solved first, as a new generation
+        '''
+        key = canonical_key(pos)
+        self.finish(verbose)
+        if self._db.execute("SELECT 1 FROM positions WHERE key = ?", (key,)).fetchone() is None:
+            self.generation += 1
+            with self._db:
+                self._db.execute("UPDATE meta SET value = ? WHERE name = 'generation'", (self.generation,))
+                self._db.execute("INSERT INTO positions (key, generation) VALUES (?, ?)", (key, self.generation))
+            self._complete = False
+            self.finish(verbose)
+        return self.value(key)
+
+    def finish(self, verbose = False) -> None:
+        '''
+        Finishes expanding and propagating the current generation, eg. after an interrupted run
+        '''
+        if self._complete:
+            return
+        start = time()
+        while self.expand_batch():
+            if verbose:
+                print(f"Expanded {self.count('expanded = 1')} of {self.count('1')} positions "
+                      f"({round(time() - start, 1)}s)")
+        while self.propagate_batch():
+            if verbose:
+                print(f"Resolved {self.count('value IS NOT NULL')} positions ({round(time() - start, 1)}s)")
+        self._complete = True
+
+    def count(self, condition) -> int:
+        return self._db.execute(f"SELECT COUNT(*) FROM positions WHERE {condition}").fetchone()[0]
+
+    def expand_batch(self) -> bool:
+        '''
+        Expands up to batch_size unexpanded positions, returns False once there are none left
+        '''
+        keys = [row[0] for row in self._db.execute(
+            "SELECT key FROM positions WHERE expanded = 0 LIMIT ?", (self.batch_size,))]
+        if len(keys) == 0:
+            return False
+
+        terminals, parents, edges = [], [], []
+        for key in keys:
+            pos = MicroChess.Position.decode(key)
+            moves = pos.player_legal_moves()
+            winner = winner_from_moves(pos, moves)
+            if winner != -1:
+                terminals.append((DRAWN if winner == DRAW else LOSS, key))
+                continue
+            children = [child_key(key, move) for move in moves]
+            parents.append((len(children), key))
+            edges.extend((key, child) for child in children)
+
+        with self._db:
+            self._db.executemany("UPDATE positions SET expanded = 1, value = ?, plies = 0, unresolved = 0 WHERE key = ?",
+                                 terminals)
+            self._db.executemany("UPDATE positions SET expanded = 1, unresolved = ? WHERE key = ?", parents)
+            self._db.executemany("INSERT OR IGNORE INTO positions (key, generation) VALUES (?, ?)",
+                                 [(child, self.generation) for parent, child in edges])
+            self._db.executemany("INSERT INTO edges VALUES (?, ?)", edges)
+            if self.generation > 1:
+                # Positions solved by an earlier generation have new parents to propagate to
+                self._db.executemany('''UPDATE positions SET propagated = 0
+                    WHERE key = ? AND generation < ? AND value IS NOT NULL''',
+                                     [(child, self.generation) for parent, child in edges])
+        return True
+
+    def propagate_batch(self) -> bool:
+        '''
+        Propagates up to batch_size resolved positions to their parents, fewest plies first
+        Returns False once there is nothing left to propagate
+        '''
+        # Only take positions with the fewest plies so that a win is always found by its
+        # shortest line and a loss is resolved by its longest
+        plies = self._db.execute('''SELECT MIN(plies) FROM positions
+            WHERE propagated = 0 AND value IS NOT NULL''').fetchone()[0]
+        if plies is None:
+            return False
+        rows = self._db.execute('''SELECT key, value FROM positions
+            WHERE propagated = 0 AND value IS NOT NULL AND plies = ? LIMIT ?''', (plies, self.batch_size)).fetchall()
+
+        with self._db:
+            self._db.execute("DELETE FROM batch")
+            self._db.executemany("INSERT INTO batch VALUES (?, ?)", rows)
+            # Drawn terminal positions say nothing about their parents
+            # A parent that can move into a position lost for the opponent is a WIN
+            self._db.execute('''UPDATE positions SET value = ?, plies = ?
+                WHERE value IS NULL AND generation = ? AND key IN
+                    (SELECT parent FROM batch JOIN edges ON child = batch.key WHERE batch.value = ?)''',
+                             (WIN, plies + 1, self.generation, LOSS))
+            # A parent whose every move leads to a position won for the opponent is a LOSS
+            won = self._db.execute('''SELECT parent, COUNT(*) FROM batch JOIN edges ON child = batch.key
+                WHERE batch.value = ? GROUP BY parent''', (WIN,)).fetchall()
+            self._db.executemany('''UPDATE positions SET unresolved = unresolved - ?
+                WHERE key = ? AND value IS NULL AND generation = ?''',
+                                 [(n, parent, self.generation) for parent, n in won])
+            self._db.executemany('''UPDATE positions SET value = ?, plies = ?
+                WHERE key = ? AND value IS NULL AND unresolved = 0''',
+                                 [(LOSS, plies + 1, parent) for parent, n in won])
+            self._db.execute("UPDATE positions SET propagated = 1 WHERE key IN (SELECT key FROM batch)")
+        return True
+
+    def value(self, key) -> int:
+        '''
+        Returns the value of a solved position relative to the player to move: WIN, LOSS or DRAWN
+        '''
+        value = self._db.execute("SELECT value FROM positions WHERE key = ?", (key,)).fetchone()[0]
+        return DRAWN if value is None else value
+
+    def plies(self, key) -> int:
+        '''
+        Returns the number of plies to the end of the game with best play from a won or lost
+        position in the store, or None if the position isn't stored or isn't won or lost
+        '''
+        row = self._db.execute("SELECT plies FROM positions WHERE key = ? AND value IS NOT NULL", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def winner(self) -> int:
+        '''
+        Returns who wins the root with best play: BLACK, WHITE or DRAW
+        '''
+        value = self.value(self.root)
+        if value == DRAWN:
+            return DRAW
+        turn = self.root[0]
+        return turn if value == WIN else 1 - turn
+
+    def best_line(self, max_plies = 50, pos = None) -> 'List':
+        '''
+        Returns the moves of a best play line from pos, which must be solved, or the root
+        The winner plays the fastest win and the loser the slowest loss
+        Drawn lines are cut off after max_plies
+        '''
+        line = []
+        if pos is None:
+            pos = MicroChess.Position.decode(self.root)
+        while len(line) < max_plies and pos.winner() == -1:
+            value = self.value(canonical_key(pos))
+            best_move, best_score = None, None
+            for move in pos.player_legal_moves():
+                key = child_key(canonical_key(pos), move)
+                child_value, child_plies = self._db.execute(
+                    "SELECT value, plies FROM positions WHERE key = ?", (key,)).fetchone()
+                child_value = DRAWN if child_value is None else child_value
+                # We want the child to have the opposite value to ours
+                if child_value != -value:
+                    continue
+                score = -child_plies if value == WIN else (child_plies or 0)
+                if best_score is None or score > best_score:
+                    best_move, best_score = move, score
+            line.append(best_move)
+            pos = pos.result(best_move)
+        return line
+
+    def close(self):
+        self._db.close()
+
+class _NodeLimit(Exception):
+    pass
+
+class ProofNumberSearch:
+    '''
+    Depth-first proof-number search (df-pn) for whether a player can force a win
+
+    Positions with at most endgame_pieces pieces are looked up in the retrograde store of a
+    Solver on the same file, and solved into it the first time they are reached, so the search
+    only has to find its way to the endgames. Proof and disproof numbers are kept in an
+    in-memory LRU of at most max_entries positions. Proved and disproved positions are also
+    written to the file, so a search that is interrupted or runs out of nodes resumes from them.
+
+    Repeating a position on the current line never wins for the attacker. A disproof that
+    relies on repeating a position above it only holds on that line, so it isn't stored
+    (the graph history interaction problem). Proofs never rely on repetitions.
+    '''
+
+    def __init__(self, path, endgame_pieces = 4, max_entries = 1000000, batch_size = 10000):
+        '''
+        path --- SQLite file storing the endgames and solved positions, str
+        endgame_pieces --- Positions with at most this many pieces (kings included) are solved
+            by retrograde analysis, int
+        max_entries --- Maximum number of positions whose proof numbers are kept in memory, int
+        batch_size --- Number of positions per transaction of the retrograde analysis, int
+        '''
+        self.endgame_pieces = endgame_pieces
+        self.max_entries = max_entries
+        self.endgames = Solver(path, batch_size = batch_size)
+        self._db = self.endgames._db
+        self._db.execute('''CREATE TABLE IF NOT EXISTS proofs (key BLOB, attacker INTEGER, proven INTEGER,
+            PRIMARY KEY (key, attacker))''')
+        # (key, attacker) -> [proof number, disproof number]
+        self._entries = OrderedDict()
+        self._pending = []
+        self._path = {}
+        self.nodes = 0
+        self.max_nodes = None
+
+    def solve(self, pos, max_nodes = None) -> int:
+        '''
+        Returns the value of pos relative to the player to move: WIN, LOSS or DRAWN,
+        or None if either search ran out of nodes (see prove)
+        '''
+        turn = pos.get_turn()
+        wins = self.prove(pos, turn, max_nodes)
+        if wins is None or wins:
+            return None if wins is None else WIN
+        loses = self.prove(pos, 1 - turn, max_nodes)
+        if loses is None:
+            return None
+        return LOSS if loses else DRAWN
+
+    def prove(self, pos, attacker, max_nodes = None) -> bool:
+        '''
+        Returns True if attacker can force a win from pos and False if they can't
+        Returns None if max_nodes positions were searched without finding out
+        '''
+        key = canonical_key(pos)
+        entry = self._final(pos, key, attacker)
+        if entry is not None:
+            return entry[0] == 0
+        self.nodes = 0
+        self.max_nodes = max_nodes
+        self._path = {}
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+        try:
+            pn, dn, repetition = self._mid(pos, key, attacker, INFINITY, INFINITY, 0)
+        except _NodeLimit:
+            return None
+        finally:
+            self.flush()
+        return pn == 0
+
+    def _final(self, pos, key, attacker):
+        '''
+        Returns [0, INFINITY] if pos is known to be won for attacker, [INFINITY, 0] if it is known
+        not to be, or None. Terminal positions and endgames are solved here
+        '''
+        entry = self._lookup(key, attacker)
+        if entry is not None and (entry[0] == 0 or entry[1] == 0):
+            return entry
+        winner = pos.winner()
+        if winner == -1 and len(pos.get_black_pieces()) + len(pos.get_white_pieces()) <= self.endgame_pieces:
+            value = self.endgames.solve_position(pos)
+            turn = pos.get_turn()
+            winner = DRAW if value == DRAWN else (turn if value == WIN else 1 - turn)
+        if winner == -1:
+            return None
+        entry = [0, INFINITY] if winner == attacker else [INFINITY, 0]
+        self._store(key, attacker, entry)
+        return entry
+
+    def _mid(self, pos, key, attacker, proof_threshold, disproof_threshold, depth):
+        '''
+        Searches pos until its proof number reaches proof_threshold or its disproof number
+        reaches disproof_threshold. Returns [proof number, disproof number, repetition] where
+        repetition is the depth of the highest position on the current line that a disproof
+        relies on repeating, or INFINITY
+        '''
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise _NodeLimit()
+        attacking = pos.get_turn() == attacker
+        self._path[key] = depth
+
+        # [position, key, [proof number, disproof number, repetition]] for each distinct child
+        children = {}
+        for move in pos.player_legal_moves():
+            child = pos.result_copy(move)
+            child_key = canonical_key(child)
+            if child_key in children:
+                continue
+            if child_key in self._path:
+                numbers = [INFINITY, 0, self._path[child_key]]
+            else:
+                entry = self._final(child, child_key, attacker) or self._lookup(child_key, attacker) or [1, 1]
+                numbers = entry + [INFINITY]
+            children[child_key] = [child, child_key, numbers]
+        children = list(children.values())
+
+        while True:
+            for child in children:
+                # Siblings' searches may have updated a child through a transposition
+                entry = self._entries.get((child[1], attacker))
+                if entry is not None and child[2][2] == INFINITY:
+                    child[2] = entry + [INFINITY]
+            proof_numbers = [child[2][0] for child in children]
+            disproof_numbers = [child[2][1] for child in children]
+            if attacking:
+                pn, dn = min(proof_numbers), min(sum(disproof_numbers), INFINITY)
+            else:
+                pn, dn = min(sum(proof_numbers), INFINITY), min(disproof_numbers)
+            if pn >= proof_threshold or dn >= disproof_threshold:
+                break
+
+            # Search the most proving child until it is no longer the most proving
+            if attacking:
+                order = sorted(range(len(children)), key = lambda i: proof_numbers[i])
+                best = children[order[0]]
+                second = proof_numbers[order[1]] if len(order) > 1 else INFINITY
+                child_pn_threshold = min(proof_threshold, second + 1)
+                child_dn_threshold = min(disproof_threshold - dn + best[2][1], INFINITY)
+            else:
+                order = sorted(range(len(children)), key = lambda i: disproof_numbers[i])
+                best = children[order[0]]
+                second = disproof_numbers[order[1]] if len(order) > 1 else INFINITY
+                child_dn_threshold = min(disproof_threshold, second + 1)
+                child_pn_threshold = min(proof_threshold - pn + best[2][0], INFINITY)
+            best[2] = self._mid(best[0], best[1], attacker, child_pn_threshold, child_dn_threshold, depth + 1)
+        del self._path[key]
+
+        repetition = INFINITY
+        if dn == 0:
+            reps = [child[2][2] for child in children if child[2][1] == 0]
+            repetition = min(reps) if attacking else max(reps)
+        if repetition >= depth:
+            repetition = INFINITY
+            self._store(key, attacker, [pn, dn])
+        return [pn, dn, repetition]
+
+    def _lookup(self, key, attacker):
+        entry = self._entries.get((key, attacker))
+        if entry is not None:
+            self._entries.move_to_end((key, attacker))
+            return entry
+        row = self._db.execute("SELECT proven FROM proofs WHERE key = ? AND attacker = ?", (key, attacker)).fetchone()
+        if row is None:
+            return None
+        entry = [0, INFINITY] if row[0] else [INFINITY, 0]
+        self._remember(key, attacker, entry)
+        return entry
+
+    def _store(self, key, attacker, entry):
+        self._remember(key, attacker, entry)
+        if entry[0] == 0 or entry[1] == 0:
+            self._pending.append((key, attacker, entry[0] == 0))
+            if len(self._pending) >= 1000:
+                self.flush()
+
+    def _remember(self, key, attacker, entry):
+        self._entries[(key, attacker)] = entry
+        self._entries.move_to_end((key, attacker))
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last = False)
+
+    def flush(self):
+        '''
+        Writes the positions proved or disproved since the last flush to the file
+        '''
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO proofs VALUES (?, ?, ?)", self._pending)
+        self._pending = []
+
+    def _wins_within(self, pos, attacker, plies) -> bool:
+        '''
+        Returns whether attacker can force a win from pos within plies plies
+        '''
+        winner = pos.winner()
+        if winner != -1:
+            return winner == attacker
+        if plies == 0:
+            return False
+        if len(pos.get_black_pieces()) + len(pos.get_white_pieces()) <= self.endgame_pieces:
+            value = self.endgames.solve_position(pos)
+            if value == DRAWN or (value == WIN) != (pos.get_turn() == attacker):
+                return False
+            return self.endgames.plies(canonical_key(pos)) <= plies
+        children = (pos.result_copy(move) for move in pos.player_legal_moves())
+        if pos.get_turn() == attacker:
+            return any(self._wins_within(child, attacker, plies - 1) for child in children)
+        return all(self._wins_within(child, attacker, plies - 1) for child in children)
+
+    def winning_line(self, pos, max_plies = 50, max_nodes = None, short_plies = 5) -> 'List':
+        '''
+        Returns the moves of a line from pos, which must be solved, where the winner keeps a forced
+        win. It is not necessarily best play: proofs don't say how long a win takes, so outside
+        the retrograde store the win can take longer than it has to
+        Wins within short_plies plies are found exactly and played fastest first, then the winner
+        plays to the child in the store with the fewest plies to the end, otherwise prefers
+        capturing (towards the endgames). The loser avoids those the other way round, and
+        otherwise prefers keeping their pieces
+        Both prefer positions not seen yet on the line. Drawn lines keep a draw and are cut off
+        after max_plies. Once the line reaches an endgame, it follows the store's best line
+        '''
+        line, seen = [], set()
+        pos = pos.create_copy()
+        value = self.solve(pos, max_nodes)
+        while value is not None and len(line) < max_plies and pos.winner() == -1:
+            if len(pos.get_black_pieces()) + len(pos.get_white_pieces()) <= self.endgame_pieces:
+                return line + self.endgames.best_line(max_plies - len(line), pos)
+            seen.add(canonical_key(pos))
+            turn = pos.get_turn()
+            moves = []
+            for move in pos.player_legal_moves():
+                child = pos.result_copy(move)
+                if value == WIN:
+                    good = self.prove(child, turn, max_nodes)
+                elif value == DRAWN:
+                    good = self.prove(child, 1 - turn, max_nodes) is False
+                else:
+                    good = True
+                if not good:
+                    continue
+                key = canonical_key(child)
+                num_pieces = len(child.get_black_pieces()) + len(child.get_white_pieces())
+                # Lower ranks are played first
+                if value == DRAWN:
+                    rank = [0, -num_pieces]
+                else:
+                    winner = turn if value == WIN else 1 - turn
+                    short = next((plies for plies in range(short_plies + 1)
+                                  if self._wins_within(child, winner, plies)), None)
+                    plies = self.endgames.plies(key)
+                    if short is not None:
+                        rank = [0, short] if value == WIN else [2, -short]
+                    elif plies is not None:
+                        rank = [1, plies] if value == WIN else [1, -plies]
+                    else:
+                        rank = [2, num_pieces] if value == WIN else [0, -num_pieces]
+                moves.append([key in seen] + rank + [move])
+            if len(moves) == 0:
+                break
+            move = min(moves, key = lambda m: m[:3])[3]
+            line.append(move)
+            pos = pos.result(move)
+            value = -value
+        return line
+
+    def close(self):
+        self.flush()
+        self.endgames.close()
+
+def main():
+    '''
+    Handles command line input
+
+    Users should run: python3 solver.py store_file [max_nodes] [endgame_pieces]
+    Solves the initial position with a proof-number search that stops after max_nodes positions
+    per search, solving endgames of at most endgame_pieces pieces by retrograde analysis
+    With endgame_pieces = 10 the whole game is solved by retrograde analysis and a best play
+    line is printed, otherwise a line where the winner keeps a forced win (see winning_line)
+    Running it again on the same store_file resumes from the positions already solved
+    '''
+    argv = sys.argv
+    max_nodes = int(argv[2]) if len(argv) > 2 else None
+    endgame_pieces = int(argv[3]) if len(argv) > 3 else 4
+    pos = MicroChess().initial_pos()
+    names = {BLACK: "BLACK wins", WHITE: "WHITE wins", DRAW: "Draw"}
+    start = time()
+    if endgame_pieces >= len(pos.get_black_pieces()) + len(pos.get_white_pieces()):
+        solver = Solver(argv[1])
+        winner, line = solver.solve(verbose = True)
+        print(f"Value of the initial position: {names[winner]} ({round(time() - start, 1)}s)")
+        print(f"Best play: {line}")
+        solver.close()
+        return
+    search = ProofNumberSearch(argv[1], endgame_pieces)
+    value = search.solve(pos, max_nodes)
+    if value is None:
+        print(f"Not solved within {max_nodes} positions per search ({round(time() - start, 1)}s), "
+              f"run again to resume")
+    else:
+        turn = pos.get_turn()
+        winner = DRAW if value == DRAWN else (turn if value == WIN else 1 - turn)
+        print(f"Value of the initial position: {names[winner]} ({round(time() - start, 1)}s)")
+        print(f"Line: {search.winning_line(pos, max_nodes = max_nodes)}")
+    search.close()
+
+if __name__ == "__main__":
+    main()
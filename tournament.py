@@ -0,0 +1,253 @@
+from contextlib import contextmanager
+from functools import partial
+from math import log10
+from multiprocessing import Pool
+import random
+import sys
+from time import time
+
+from piece import BLACK
+from microchess import DRAW
+import evaluate_heuristic as eh
+
+INITIAL_RATING = 1500
+
+# Entrants of the tournament run by this process, set by Tournament or the pool initializer
+_entrants = {}
+
+def _init_worker(entrants):
+    global _entrants
+    _entrants = entrants
+
+def _play(job):
+    '''
+    Worker that plays one game and returns [black, white, winner]
+    '''
+    black, white, seed, prob, depth, quiescence = job
+    # Its own generator, so playing in this process leaves the module random stream alone
+    winner = eh.play_game(_entrants[black], _entrants[white], prob, depth, quiescence, random.Random(seed))
+    return [black, white, winner]
+
+def weights_heuristic(weights):
+    '''
+    Returns a picklable value_based_heuristic for weights so it can be used by worker processes
+    '''
+    return partial(eh.value_based_heuristic, weights = list(weights))
+
+def expected_score(rating, opponent_rating) -> float:
+    '''
+    Returns the expected score of a player rated rating against one rated opponent_rating
+    '''
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+class Tournament:
+
+    def __init__(self, entrants, depth, prob, processes = 1, log_path = None, k_factor = 16, quiescence = False):
+        '''
+        Initialize a tournament between heuristics
+
+        entrants --- dict from name to a function that given Position returns a value
+            Functions must be picklable (see weights_heuristic) when processes > 1
+        depth --- Depth of minimax search
+        prob --- Probability that the agents will not play randomly
+        processes --- Number of worker processes playing games in parallel
+        log_path --- Optional file every result is appended to, one "black white winner" line per game
+        k_factor --- How far a single result moves the Elo ratings
+        quiescence --- Whether the minimax agents extend their leaves with a capture search
+        '''
+        self.entrants = entrants
+        self.depth = depth
+        self.prob = prob
+        self.processes = processes
+        self.log_path = log_path
+        self.k_factor = k_factor
+        self.quiescence = quiescence
+
+        self.ratings = {name: INITIAL_RATING for name in entrants}
+        # List of [black, white, winner]
+        self.results = []
+        self.opponents = {name: set() for name in entrants}
+        # Pool shared by the games played inside a pool() block
+        self._pool = None
+
+    def record(self, black, white, winner) -> None:
+        '''
+        Records the result of a game, updating the Elo ratings and the log
+        '''
+        score = 0.5 if winner == DRAW else (1 if winner == BLACK else 0)
+        change = self.k_factor * (score - expected_score(self.ratings[black], self.ratings[white]))
+        self.ratings[black] += change
+        self.ratings[white] -= change
+        self.results.append([black, white, winner])
+        self.opponents[black].add(white)
+        self.opponents[white].add(black)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as f:
+                f.write(f"{black}\t{white}\t{winner}\n")
+
+    def play(self, pairings) -> None:
+        '''
+        Plays every [black, white] game in pairings, recording results as they come in
+        '''
+        jobs = [(black, white, random.random(), self.prob, self.depth, self.quiescence) for black, white in pairings]
+        if self.processes <= 1:
+            _init_worker(self.entrants)
+            for job in jobs:
+                self.record(*_play(job))
+            return
+        with self.pool():
+            for result in self._pool.imap_unordered(_play, jobs):
+                self.record(*result)
+
+    @contextmanager
+    def pool(self):
+        '''
+        Keeps one pool of worker processes for every game played inside the with block,
+        instead of starting one per call to play. Closed when the block exits
+        '''
+        if self.processes <= 1 or self._pool is not None:
+            yield
+            return
+        with Pool(self.processes, _init_worker, (self.entrants,)) as pool:
+            self._pool = pool
+            try:
+                yield
+            finally:
+                self._pool = None
+
+    def round_robin(self, games_per_pair = 2) -> None:
+        '''
+        Every entrant plays every other entrant games_per_pair times, alternating colors
+        '''
+        names = list(self.entrants)
+        pairings = []
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                for k in range(games_per_pair):
+                    pairings.append([names[i], names[j]] if k % 2 == 0 else [names[j], names[i]])
+        self.play(pairings)
+
+    def swiss(self, num_rounds) -> None:
+        '''
+        Plays num_rounds Swiss rounds: each round, entrants are sorted by rating and paired with
+        the closest rated entrant they haven't played yet
+        With an odd number of entrants, the lowest rated unpaired entrant sits the round out
+        '''
+        with self.pool():
+            for _ in range(num_rounds):
+                self.play(self.swiss_pairings())
+
+    def swiss_pairings(self) -> 'List':
+        unpaired = sorted(self.entrants, key = self.ratings.get, reverse = True)
+        pairings = []
+        while len(unpaired) > 1:
+            player = unpaired.pop(0)
+            opponent = next((o for o in unpaired if o not in self.opponents[player]), unpaired[0])
+            unpaired.remove(opponent)
+            pairings.append([player, opponent] if random.random() < 0.5 else [opponent, player])
+        return pairings
+
+    def standings(self) -> 'List':
+        '''
+        Returns [name, rating] for every entrant from best to worst by Elo rating
+        '''
+        return sorted(self.ratings.items(), key = lambda e: e[1], reverse = True)
+
+    def bradley_terry(self, iterations = 100) -> dict:
+        '''
+        Returns Bradley-Terry ratings fitted to every result so far, on the Elo scale
+        Unlike the incremental Elo ratings, these don't depend on the order games finished in
+        '''
+        return bradley_terry(self.entrants, self.results, iterations)
+
+def bradley_terry(names, results, iterations = 100) -> dict:
+    '''
+    Fits Bradley-Terry strengths with the MM algorithm and returns them on the Elo scale
+    Draws count as half a win for each player. Every player also gets one virtual draw against
+    an average player so that unbeaten or winless players still get a finite rating
+
+    names --- Names of the players
+    results --- List of [black, white, winner]
+    '''
+    wins = {name: 0.5 for name in names}
+    games = {name: {} for name in names}
+    for black, white, winner in results:
+        if winner == DRAW:
+            wins[black] += 0.5
+            wins[white] += 0.5
+        else:
+            wins[black if winner == BLACK else white] += 1
+        games[black][white] = games[black].get(white, 0) + 1
+        games[white][black] = games[white].get(black, 0) + 1
+
+    strength = {name: 1 for name in names}
+    for _ in range(iterations):
+        new_strength = {}
+        for name in names:
+            # The virtual game against a player of strength 1
+            denom = 1 / (strength[name] + 1)
+            for opponent, n in games[name].items():
+                denom += n / (strength[name] + strength[opponent])
+            new_strength[name] = wins[name] / denom
+        strength = new_strength
+    mean = sum(log10(s) for s in strength.values()) / len(strength)
+    return {name: INITIAL_RATING + 400 * (log10(strength[name]) - mean) for name in names}
+
+def load_log(log_path) -> 'List':
+    '''
+    Reads the results appended to log_path by a Tournament, as a list of [black, white, winner]
+    '''
+    results = []
+    with open(log_path) as f:
+        for line in f:
+            black, white, winner = line.rstrip("\n").split("\t")
+            results.append([black, white, int(winner)])
+    return results
+
+def rank_population(pop, num_rounds, prob, depth, processes = 1) -> 'List[float]':
+    '''
+    Ranks a population of weights with one Swiss tournament, with uniform_heuristic as an extra entrant
+    Returns, for each weights, the expected score against uniform_heuristic implied by the ratings
+    so that it is on the same scale as the win percentage from compare_heuristic
+
+    pop --- List of weights as taken by value_based_heuristic
+    num_rounds --- Number of Swiss rounds, each entrant plays one game per round
+    prob --- Probability that the agents will not play randomly
+    depth --- Depth of minimax search
+    processes --- Number of worker processes playing games in parallel
+    '''
+    entrants = {str(i): weights_heuristic(weights) for i, weights in enumerate(pop)}
+    entrants["uniform"] = eh.uniform_heuristic
+    tournament = Tournament(entrants, depth, prob, processes)
+    tournament.swiss(num_rounds)
+    ratings = tournament.bradley_terry()
+    return [expected_score(ratings[str(i)], ratings["uniform"]) for i in range(len(pop))]
+
+def main():
+    '''
+    Runs a round robin between the built in heuristics
+
+    Users should run: python3 tournament.py games_per_pair prob depth [processes] [log_file]
+    '''
+    argv = sys.argv
+    games_per_pair = int(argv[1])
+    prob = float(argv[2])
+    depth = int(argv[3])
+    processes = int(argv[4]) if len(argv) > 4 else 1
+    log_path = argv[5] if len(argv) > 5 else None
+
+    entrants = {
+        "simple": eh.simple_heuristic,
+        "uniform": eh.uniform_heuristic,
+        "random": eh.random_heuristic
+    }
+    start = time()
+    tournament = Tournament(entrants, depth, prob, processes, log_path)
+    tournament.round_robin(games_per_pair)
+    bt_ratings = tournament.bradley_terry()
+    print(f"Tournament took {round(time() - start, 1)}s for {len(tournament.results)} games")
+    for name, rating in tournament.standings():
+        print(f"{name}: Elo {round(rating)}, Bradley-Terry {round(bt_ratings[name])}")
+
+if __name__ == "__main__":
+    main()